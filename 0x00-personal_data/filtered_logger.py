@@ -4,14 +4,80 @@ This module contains functions and classes to filter sensitive information
 from logs and to securely connect and read data from a database.
 """
 
+import argparse
+import functools
+import json
 import logging
 import os
+import queue
 import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
 import mysql.connector
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Any, Callable, Dict, Iterator, List, Mapping, Optional, Pattern, Sequence,
+    TextIO, Tuple, Union
+)
 
 
 PII_FIELDS: Tuple[str, ...] = ("name", "email", "phone", "ssn", "password")
+USER_COLUMNS: Tuple[str, ...] = (
+    "name", "email", "phone", "ssn", "password", "ip", "last_login",
+    "user_agent"
+)
+
+
+@functools.lru_cache(maxsize=128)
+def _redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """
+    Compile a single alternation pattern matching any of the fields.
+
+    Args:
+        fields (Tuple[str, ...]): Field names to match.
+        separator (str): Field separator in the log message.
+
+    Returns:
+        Pattern: Compiled pattern capturing the field name in group 1.
+    """
+    alternation = "|".join(re.escape(field) for field in fields)
+    return re.compile(f"({alternation})=.*?{re.escape(separator)}")
+
+
+def make_redactor(
+    fields: Sequence[str], redaction: str, separator: str
+) -> Callable[[str], str]:
+    """
+    Build a function that obfuscates fields in a single pass.
+
+    The pattern is compiled once and cached per (fields, separator), so
+    repeated calls with the same configuration share the compiled regex.
+
+    Args:
+        fields (Sequence[str]): Fields to obfuscate.
+        redaction (str): Replacement text for obfuscation.
+        separator (str): Field separator in the log message.
+
+    Returns:
+        Callable[[str], str]: Function redacting a log message.
+    """
+    fields = tuple(fields)
+    if not fields:
+        return lambda message: message
+
+    pattern = _redaction_pattern(fields, separator)
+    replacements = {
+        field: f"{field}={redaction}{separator}" for field in fields
+    }
+
+    def redact(message: str) -> str:
+        """Obfuscate all configured fields in one scan of the message."""
+        return pattern.sub(lambda m: replacements[m.group(1)], message)
+
+    return redact
 
 
 def filter_datum(
@@ -30,13 +96,49 @@ def filter_datum(
     Returns:
         str: Obfuscated log message.
     """
-    for field in fields:
-        message = re.sub(
-            f"{field}=.*?{separator}",
-            f"{field}={redaction}{separator}",
-            message
-        )
-    return message
+    return make_redactor(fields, redaction, separator)(message)
+
+
+def redact_row(
+    row: Union[Mapping[str, Any], Sequence], fields: frozenset, redaction: str
+) -> Dict[str, Any]:
+    """
+    Obfuscate fields of a structured row by name, without any regex.
+
+    Args:
+        row (Union[Mapping[str, Any], Sequence]): Column/value mapping, or
+            a users row tuple ordered as USER_COLUMNS.
+        fields (frozenset): Names of the fields to obfuscate.
+        redaction (str): Replacement text for obfuscation.
+
+    Returns:
+        Dict[str, Any]: Copy of the row with sensitive values replaced.
+    """
+    items = row.items() if isinstance(row, Mapping) else zip(USER_COLUMNS, row)
+    return {
+        name: redaction if name in fields else value for name, value in items
+    }
+
+
+def serialize_row(
+    row: Mapping[str, Any], separator: str, json_lines: bool = False
+) -> str:
+    """
+    Serialize a row once, as `key=value;` pairs or as a JSON object.
+
+    Args:
+        row (Mapping[str, Any]): Column/value mapping to serialize.
+        separator (str): Field separator for the key=value form.
+        json_lines (bool): Emit a JSON object instead of key=value pairs.
+
+    Returns:
+        str: Serialized row.
+    """
+    if json_lines:
+        return json.dumps(row, default=str)
+    return " ".join(
+        f"{name}={value}{separator}" for name, value in row.items()
+    )
 
 
 class RedactingFormatter(logging.Formatter):
@@ -46,45 +148,448 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
-        """Initialize formatter with fields to filter."""
+    def __init__(self, fields: List[str], json_lines: bool = False):
+        """
+        Initialize formatter with fields to filter.
+
+        Records logged with a `row` extra (a dict, or a users tuple) are
+        redacted by field name and serialized once, as key=value pairs or,
+        when `json_lines` is set, as one JSON object per line; other
+        records go through the regex redactor.
+        """
         super().__init__(self.FORMAT)
         self.fields = fields
+        self.json_lines = json_lines
+        self._field_set = frozenset(fields)
+        self._redact = make_redactor(fields, self.REDACTION, self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
-        """Filter sensitive fields from log records."""
-        record.msg = filter_datum(
-            self.fields,
-            self.REDACTION,
-            record.getMessage(),
-            self.SEPARATOR
-        )
+        """
+        Filter sensitive fields from log records.
+
+        In JSON mode every record is a single JSON object, without the
+        FORMAT prefix: a row record is its redacted row, any other record
+        carries the logger name, level, time and redacted message.
+        """
+        row = getattr(record, "row", None)
+        if self.json_lines:
+            if row is not None:
+                return serialize_row(
+                    redact_row(row, self._field_set, self.REDACTION),
+                    self.SEPARATOR,
+                    True
+                )
+            return json.dumps({
+                "logger": record.name,
+                "level": record.levelname,
+                "time": self.formatTime(record),
+                "message": self._redact(record.getMessage()),
+            })
+        if row is not None:
+            record.msg = serialize_row(
+                redact_row(row, self._field_set, self.REDACTION),
+                self.SEPARATOR
+            )
+        else:
+            record.msg = self._redact(record.getMessage())
+        record.args = None
         return super().format(record)
 
 
-def get_logger() -> logging.Logger:
+class AsyncRedactingHandler(logging.Handler):
+    """
+    Queue-backed handler that formats and writes records off-thread.
+
+    Records are pushed onto a bounded queue by the calling thread and a
+    pool of background workers drains them in batches, formatting each one
+    and writing the whole batch with a single call to the stream.
+    """
+
+    POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(
+        self,
+        stream=None,
+        capacity: int = 10000,
+        workers: int = 1,
+        batch_size: int = 256,
+        policy: str = "block",
+        timeout: Optional[float] = None
+    ):
+        """
+        Initialize the handler and start its workers.
+
+        Args:
+            stream: Writable text stream, defaults to sys.stderr.
+            capacity (int): Maximum number of queued records.
+            workers (int): Number of background writer threads.
+            batch_size (int): Maximum records written per batch.
+            policy (str): What to do when the queue is full: "block" waits
+                (up to `timeout` seconds), "drop_newest" discards the
+                incoming record, "drop_oldest" discards the oldest queued.
+            timeout (Optional[float]): Blocking limit for "block" policy.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.queue: queue.Queue = queue.Queue(maxsize=capacity)
+        self.batch_size = batch_size
+        self.policy = policy
+        self.timeout = timeout
+        self.dropped = 0
+        self.written = 0
+        self._stop = object()
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, daemon=True)
+            for _ in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of records waiting to be written."""
+        return self.queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Snapshot of the handler counters.
+
+        Returns:
+            Dict[str, int]: Queue depth, written and dropped record counts.
+        """
+        with self._count_lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "written": self.written,
+                "dropped": self.dropped,
+            }
+
+    def _drop(self) -> None:
+        """Count one discarded record."""
+        with self._count_lock:
+            self.dropped += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Enqueue a record according to the backpressure policy."""
+        if self._closed:
+            self._drop()
+            return
+        if self.policy == "block":
+            try:
+                self.queue.put(record, timeout=self.timeout)
+            except queue.Full:
+                self._drop()
+        elif self.policy == "drop_newest":
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._drop()
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    if self._closed:
+                        self._drop()
+                        return
+                    try:
+                        oldest = self.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    self.queue.task_done()
+                    if oldest is self._stop:
+                        # close() is stopping the workers: give the
+                        # sentinel back and drop the incoming record
+                        self.queue.put(oldest)
+                        self._drop()
+                        return
+                    self._drop()
+
+    def _next_batch(self) -> Tuple[List[logging.LogRecord], bool]:
+        """Block for one record, then drain up to a full batch."""
+        batch = []
+        item = self.queue.get()
+        while True:
+            if item is self._stop:
+                return batch, True
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+
+    def _run(self) -> None:
+        """Worker loop: format and write batches until told to stop."""
+        while True:
+            batch, stop = self._next_batch()
+            lines = []
+            for record in batch:
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if lines:
+                with self._write_lock:
+                    try:
+                        self.stream.write("\n".join(lines) + "\n")
+                        self.stream.flush()
+                        with self._count_lock:
+                            self.written += len(lines)
+                    except Exception:
+                        self.handleError(batch[-1])
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+            if stop:
+                return
+
+    def flush(self) -> None:
+        """Wait until every queued record has been written."""
+        if not self._closed:
+            self.queue.join()
+
+    def close(self) -> None:
+        """Flush pending records, stop the workers and close the handler."""
+        if not self._closed:
+            self._closed = True
+            for _ in self._workers:
+                self.queue.put(self._stop)
+            for worker in self._workers:
+                worker.join()
+        super().close()
+
+
+def get_logger(asynchronous: bool = False, **options) -> logging.Logger:
     """
     Create and configure a logger for user data.
 
+    Args:
+        asynchronous (bool): Use an AsyncRedactingHandler so redaction and
+            writes happen on background threads instead of the caller's.
+        **options: Keyword arguments forwarded to AsyncRedactingHandler.
+
     Returns:
         logging.Logger: Configured logger instance.
     """
     logger = logging.getLogger("user_data")
     logger.setLevel(logging.INFO)
     logger.propagate = False
-    handler = logging.StreamHandler()
+    if asynchronous:
+        handler = AsyncRedactingHandler(**options)
+    else:
+        handler = logging.StreamHandler()
     handler.setFormatter(RedactingFormatter(fields=PII_FIELDS))
     logger.addHandler(handler)
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+class PooledConnection:
     """
-    Connect to a secure database using environment variables.
+    Proxy around a pooled connection.
 
-    Returns:
-        mysql.connector.connection.MySQLConnection: Database connection object.
+    Behaves like the underlying connection, except that close() hands the
+    connection back to its pool instead of tearing it down.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn, created_at: float):
+        """Wrap `conn`, checked out from `pool`."""
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name: str):
+        """Delegate everything else to the real connection."""
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError(
+                "Connection already returned to the pool"
+            )
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        """Return the connection to the pool."""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._release(conn, self._created_at)
+
+    def __enter__(self) -> "PooledConnection":
+        """Use the connection as a context manager."""
+        return self
+
+    def __exit__(self, *exc) -> None:
+        """Return the connection to the pool on exit."""
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of database connections.
+
+    Idle connections are health-checked on checkout and recycled once they
+    are older than `recycle` seconds. Callers wait up to `timeout` seconds
+    for a free slot.
     """
+
+    def __init__(
+        self,
+        connect: Callable,
+        size: int = 5,
+        timeout: float = 30.0,
+        recycle: float = 3600.0
+    ):
+        """
+        Initialize an empty pool; connections are opened lazily.
+
+        Args:
+            connect (Callable): Factory returning a new raw connection.
+            size (int): Maximum number of open connections.
+            timeout (float): Seconds to wait for a free connection.
+            recycle (float): Maximum connection age in seconds.
+        """
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.recycled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        """Ping the server when the driver supports it."""
+        is_connected = getattr(conn, "is_connected", None)
+        try:
+            return is_connected() if is_connected is not None else True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(conn) -> None:
+        """Close a connection, ignoring errors from dead sockets."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def connect(self) -> PooledConnection:
+        """
+        Check out a connection, opening or recycling one as needed.
+
+        Returns:
+            PooledConnection: Connection to close() when done.
+
+        Raises:
+            mysql.connector.errors.PoolError: If no slot frees up in time.
+        """
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise mysql.connector.errors.PoolError(
+                f"No connection available within {self.timeout}s"
+            )
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    candidate, created_at = self._idle.get_nowait()
+                except queue.Empty:
+                    conn, created_at = self._connect(), time.monotonic()
+                    break
+                stale = time.monotonic() - created_at > self.recycle
+                if stale or not self._healthy(candidate):
+                    self._discard(candidate)
+                    with self._lock:
+                        self.recycled += 1
+                else:
+                    conn = candidate
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return PooledConnection(self, conn, created_at)
+
+    @staticmethod
+    def _reset(conn) -> None:
+        """
+        Clear what a borrower left on a connection.
+
+        Unread results (e.g. from an abandoned unbuffered cursor) are
+        drained, then the session is reset when the driver supports it,
+        which also rolls back any open transaction; other drivers only
+        roll back.
+        """
+        consume_results = getattr(conn, "consume_results", None)
+        if consume_results is not None:
+            consume_results()
+        reset_session = getattr(conn, "reset_session", None)
+        if reset_session is not None:
+            reset_session()
+        else:
+            conn.rollback()
+
+    def _release(self, conn, created_at: float) -> None:
+        """Reset a checked-out connection, put it back, free its slot."""
+        try:
+            self._reset(conn)
+        except Exception:
+            self._discard(conn)
+            with self._lock:
+                self.recycled += 1
+        else:
+            self._idle.put((conn, created_at))
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Snapshot of the pool metrics.
+
+        Returns:
+            Dict[str, float]: Checkout count, average and maximum checkout
+            wait in seconds, recycled connections and idle connections.
+        """
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_avg": (
+                    self.wait_total / self.checkouts if self.checkouts else 0.0
+                ),
+                "wait_max": self.wait_max,
+                "recycled": self.recycled,
+                "idle": self._idle.qsize(),
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _connect() -> mysql.connector.connection.MySQLConnection:
+    """Open a new, unpooled connection from the environment variables."""
     return mysql.connector.connect(
         user=os.getenv("PERSONAL_DATA_DB_USERNAME", "root"),
         password=os.getenv("PERSONAL_DATA_DB_PASSWORD", ""),
@@ -93,28 +598,344 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     )
 
 
-def main() -> None:
+def get_db_pool() -> ConnectionPool:
+    """
+    Return the process-wide connection pool, creating it on first use.
+
+    Configured with PERSONAL_DATA_DB_POOL_SIZE, PERSONAL_DATA_DB_POOL_TIMEOUT
+    and PERSONAL_DATA_DB_POOL_RECYCLE. A forked child gets its own pool
+    rather than sharing the parent's sockets.
+
+    Returns:
+        ConnectionPool: Pool of connections to the personal data database.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                _connect,
+                size=int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", "5")),
+                timeout=float(
+                    os.getenv("PERSONAL_DATA_DB_POOL_TIMEOUT", "30")
+                ),
+                recycle=float(
+                    os.getenv("PERSONAL_DATA_DB_POOL_RECYCLE", "3600")
+                )
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_db() -> mysql.connector.connection.MySQLConnection:
+    """
+    Connect to a secure database using environment variables.
+
+    When PERSONAL_DATA_DB_POOL_SIZE is set, the connection is checked out
+    of the shared pool and close() returns it there.
+
+    Returns:
+        mysql.connector.connection.MySQLConnection: Database connection object.
+    """
+    if os.getenv("PERSONAL_DATA_DB_POOL_SIZE"):
+        return get_db_pool().connect()
+    return _connect()
+
+
+def _placeholder(db) -> str:
+    """Return the DB-API parameter marker used by the connection."""
+    return "?" if isinstance(db, sqlite3.Connection) else "%s"
+
+
+def _stream_cursor(db):
+    """Open an unbuffered cursor so rows are not all fetched client-side."""
+    try:
+        return db.cursor(buffered=False)
+    except TypeError:
+        return db.cursor()
+
+
+def iter_user_batches(
+    db,
+    batch_size: int = 1000,
+    key: Optional[str] = None,
+    bounds: Optional[Tuple[int, int]] = None
+) -> Iterator[List[tuple]]:
+    """
+    Stream rows of the users table in batches of at most `batch_size`.
+
+    Without a key a single query is read through an unbuffered cursor with
+    `fetchmany`. With a key, rows are paged by keyset (`WHERE key > last
+    ORDER BY key LIMIT n`), so each query is short-lived and uses the index
+    on that column; the key must be unique for every row to be exported.
+
+    Args:
+        db: DB-API connection (MySQL, or SQLite as a local stand-in).
+        batch_size (int): Maximum number of rows per batch.
+        key (Optional[str]): Indexed, unique column to paginate on.
+        bounds (Optional[Tuple[int, int]]): Half-open `[low, high)` range
+            of `key` to restrict the export to.
+
+    Yields:
+        List[tuple]: Rows with the columns of USER_COLUMNS.
+    """
+    columns = ", ".join(USER_COLUMNS)
+    if key is None:
+        cursor = _stream_cursor(db)
+        try:
+            cursor.execute(f"SELECT {columns} FROM users;")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
+
+    if not re.fullmatch(r"\w+", key):
+        raise ValueError(f"Invalid key column: {key}")
+    mark = _placeholder(db)
+    where, params = "", ()
+    if bounds is not None:
+        where, params = f"{key} >= {mark} AND {key} < {mark}", tuple(bounds)
+    first_page = (
+        f"SELECT {columns}, {key} FROM users "
+        f"{'WHERE ' + where if where else ''} ORDER BY {key} LIMIT {mark};"
+    )
+    next_page = (
+        f"SELECT {columns}, {key} FROM users WHERE {key} > {mark} "
+        f"{'AND ' + where if where else ''} ORDER BY {key} LIMIT {mark};"
+    )
+    cursor = db.cursor()
+    try:
+        cursor.execute(first_page, params + (batch_size,))
+        while True:
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield [row[:-1] for row in rows]
+            if len(rows) < batch_size:
+                return
+            cursor.execute(
+                next_page, (rows[-1][-1],) + params + (batch_size,)
+            )
+    finally:
+        cursor.close()
+
+
+def export_users(
+    db,
+    stream: TextIO,
+    batch_size: int = 1000,
+    key: Optional[str] = None,
+    bounds: Optional[Tuple[int, int]] = None,
+    json_lines: bool = False
+) -> Dict[str, float]:
+    """
+    Write redacted log lines for every user, one bulk write per batch.
+
+    Args:
+        db: DB-API connection to read the users table from.
+        stream (TextIO): Destination for the redacted lines.
+        batch_size (int): Rows fetched and written per batch.
+        key (Optional[str]): Column for keyset pagination, if any.
+        bounds (Optional[Tuple[int, int]]): Key range to export, if any.
+        json_lines (bool): Serialize rows as JSON instead of key=value.
+
+    Returns:
+        Dict[str, float]: Exported row count, elapsed seconds and rows/sec.
+    """
+    formatter = RedactingFormatter(fields=PII_FIELDS, json_lines=json_lines)
+    count = 0
+    start = time.perf_counter()
+    for rows in iter_user_batches(db, batch_size, key, bounds):
+        lines = []
+        for row in rows:
+            record = logging.LogRecord(
+                "user_data", logging.INFO, __file__, 0, "", None, None
+            )
+            record.row = row
+            lines.append(formatter.format(record))
+        stream.write("\n".join(lines) + "\n")
+        count += len(lines)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": count,
+        "seconds": elapsed,
+        "rows_per_sec": count / elapsed if elapsed else 0.0,
+    }
+
+
+def _key_ranges(db, key: str, shards: int) -> List[Tuple[int, int]]:
+    """Split the integer `key` column into `shards` half-open ranges."""
+    if not re.fullmatch(r"\w+", key):
+        raise ValueError(f"Invalid key column: {key}")
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM users;")
+        low, high = cursor.fetchone()
+    finally:
+        cursor.close()
+    if low is None:
+        return []
+    high += 1
+    step = max(1, -(-(high - low) // shards))
+    return [
+        (start, min(start + step, high)) for start in range(low, high, step)
+    ]
+
+
+def _export_shard(
+    connect: Callable, path: str, batch_size: int, key: str,
+    bounds: Tuple[int, int], json_lines: bool
+) -> Dict[str, float]:
+    """Process pool task: export one key range to its own shard file."""
+    db = connect()
+    try:
+        with open(path, "w") as shard:
+            return export_users(
+                db, shard, batch_size, key, bounds, json_lines
+            )
+    finally:
+        db.close()
+
+
+def export_users_sharded(
+    output: str,
+    shards: int,
+    workers: Optional[int] = None,
+    batch_size: int = 1000,
+    key: str = "id",
+    connect: Callable = None,
+    json_lines: bool = False
+) -> Dict[str, float]:
+    """
+    Export redacted users in parallel, one process per key range.
+
+    The integer `key` column is split into `shards` ranges; each range is
+    exported by a pool worker over its own connection into
+    `<output>.part<N>`, and the shards are then concatenated into `output`
+    in key order.
+
+    Args:
+        output (str): Path of the merged export file.
+        shards (int): Number of key ranges to split the table into.
+        workers (Optional[int]): Process count, defaults to the CPU count.
+        batch_size (int): Rows fetched and written per batch.
+        key (str): Indexed, unique integer column to shard on.
+        connect (Callable): Picklable connection factory, get_db by default.
+        json_lines (bool): Serialize rows as JSON instead of key=value.
+
+    Returns:
+        Dict[str, float]: Exported row count, elapsed seconds and rows/sec.
+    """
+    connect = connect or get_db
+    start = time.perf_counter()
+    db = connect()
+    try:
+        ranges = _key_ranges(db, key, shards)
+    finally:
+        db.close()
+
+    paths = [f"{output}.part{i}" for i in range(len(ranges))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _export_shard, connect, path, batch_size, key, bounds,
+                json_lines
+            )
+            for path, bounds in zip(paths, ranges)
+        ]
+        count = sum(future.result()["rows"] for future in futures)
+
+    with open(output, "w") as merged:
+        for path in paths:
+            with open(path) as shard:
+                shutil.copyfileobj(shard, merged)
+            os.remove(path)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": count,
+        "seconds": elapsed,
+        "rows_per_sec": count / elapsed if elapsed else 0.0,
+    }
+
+
+def _report(stats: Dict[str, float]) -> None:
+    """Print export throughput to stderr."""
+    print(
+        f"exported {stats['rows']} rows in {stats['seconds']:.2f}s "
+        f"({stats['rows_per_sec']:.0f} rows/sec)",
+        file=sys.stderr
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
     """
     Retrieve and log filtered data from the database.
 
     Connects to the users table, fetches each row, and logs
-    with sensitive fields filtered.
+    with sensitive fields filtered. With `--stream`, rows are exported in
+    batches through a streaming cursor and the throughput is reported;
+    `--shards N` additionally splits the export across worker processes.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments.
     """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stream", action="store_true",
+                        help="stream redacted rows in bulk batches")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="rows fetched per batch in stream mode")
+    parser.add_argument("--key", default=None,
+                        help="indexed unique column for keyset pagination")
+    parser.add_argument("--output", default=None,
+                        help="file to write to in stream mode (stdout)")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="key ranges exported in parallel processes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes for --shards (CPU count)")
+    parser.add_argument("--json", action="store_true",
+                        help="write rows as JSON lines in stream mode")
+    args = parser.parse_args(argv)
+
+    if args.shards:
+        if args.output is None:
+            parser.error("--shards requires --output")
+        stats = export_users_sharded(
+            args.output, args.shards, args.workers, args.batch_size,
+            args.key or "id", json_lines=args.json
+        )
+        _report(stats)
+        return
+
     db = get_db()
+    if args.stream:
+        try:
+            if args.output is None:
+                stats = export_users(
+                    db, sys.stdout, args.batch_size, args.key,
+                    json_lines=args.json
+                )
+            else:
+                with open(args.output, "w") as output:
+                    stats = export_users(
+                        db, output, args.batch_size, args.key,
+                        json_lines=args.json
+                    )
+        finally:
+            db.close()
+        _report(stats)
+        return
+
     cursor = db.cursor()
     cursor.execute(
-        "SELECT name, email, phone, ssn, password, ip, last_login, user_agent "
-        "FROM users;"
+        f"SELECT {', '.join(USER_COLUMNS)} FROM users;"
     )
     logger = get_logger()
 
     for row in cursor:
-        log_message = (
-            f"name={row[0]}; email={row[1]}; phone={row[2]}; ssn={row[3]}; "
-            f"password={row[4]}; ip={row[5]}; last_login={row[6]}; "
-            f"user_agent={row[7]};"
-        )
-        logger.info(log_message)
+        logger.info("", extra={"row": row})
 
     cursor.close()
     db.close()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+""" Benchmark memory per User and to_json() throughput
+
+Usage: python3 bench_models.py [size ...]   (default: 10000 100000 1000000)
+"""
+import sys
+import time
+import tracemalloc
+from typing import List
+
+from models.user import User
+
+
+def _make_users(size: int) -> List[User]:
+    """ Build `size` users as a load would, with typical field values
+    """
+    return [User(email="user{}@example.com".format(i),
+                 _password="0" * 64, first_name="First", last_name="Last",
+                 created_at="2024-01-01T00:00:00",
+                 updated_at="2024-01-01T00:00:00")
+            for i in range(size)]
+
+
+def _throughput(users: List[User], for_serialization: bool) -> float:
+    """ to_json() calls per second over every user
+    """
+    start = time.perf_counter()
+    for user in users:
+        user.to_json(for_serialization)
+    return len(users) / (time.perf_counter() - start)
+
+
+def bench(size: int):
+    """ Print memory per user (objects, then cached to_json() output) and
+    to_json() rates without and with the cache
+    """
+    tracemalloc.start()
+    users = _make_users(size)
+    objects, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cold = _throughput(users, True)
+    warm = _throughput(users, True)
+    for user in users:
+        user.first_name = "Changed"
+
+    tracemalloc.start()
+    _throughput(users, True)
+    cached, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:>9} users  {:5.0f} B/user (+{:4.0f} cached)  "
+          "to_json cold {:>8.0f}/s  cached {:>9.0f}/s".format(
+              size, objects / size, cached / size, cold, warm))
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        bench(size)
@@ -2,38 +2,108 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Optional, Set
+from os import getenv, path
+from models import snapshot
+from models.journal import Journal
+from models.store import Store, get_store, remove_stale_tmp, write_atomic
 import json
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+INDEXED_VALUES = {}
+JOURNALS = {}
+STORAGE_MODE = getenv('STORAGE_MODE', 'file')
+STORAGE_FORMAT = getenv('STORAGE_FORMAT', 'json')
+STORAGE_LAZY = getenv('STORAGE_LAZY', '0') == '1'
 
 
 class Base():
     """ Base class
+
+    Subclasses may list attributes in `indexed_attributes`: a hash index
+    (value -> object IDs) is then kept for each of them by save(),
+    remove() and load_from_file(), and search() uses it automatically.
+
+    Objects and indexes of a class are guarded by the readers-writer lock
+    of its Store; concurrent save()/remove() calls share snapshot writes
+    through group commit.
+
+    Instances use __slots__: subclasses declare theirs and list the
+    attributes to_json() exports in `serialized_attributes`. Timestamps
+    (`timestamp_attributes`) are kept as epoch seconds in `_<name>` slots
+    and exposed as datetimes.
     """
 
+    __slots__ = ('id', '_created_at', '_updated_at', '_json', '_version')
+    indexed_attributes = ()
+    serialized_attributes = ('id', 'created_at', 'updated_at')
+    timestamp_attributes = ('created_at', 'updated_at')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__._reset_indexes()
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
-        if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
-        else:
-            self.created_at = datetime.utcnow()
-        if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
-        else:
-            self.updated_at = datetime.utcnow()
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
+        now = int(time.time())
+        created_at = kwargs.get('created_at')
+        self.created_at = now if created_at is None else created_at
+        updated_at = kwargs.get('updated_at')
+        self.updated_at = now if updated_at is None else updated_at
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute and drop the cached to_json() output
+
+        `_version` changes before the cache is dropped, so a to_json()
+        running concurrently discards the output it built.
+        """
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_version',
+                           (getattr(self, '_version', 0) + 1) & 0xff)
+        object.__setattr__(self, '_json', None)
+
+    @staticmethod
+    def _epoch(value) -> int:
+        """ Epoch seconds of a naive UTC datetime, a string in
+        TIMESTAMP_FORMAT or a number
+        """
+        if isinstance(value, datetime):
+            return snapshot.to_epoch(value)
+        if isinstance(value, str):
+            return snapshot.to_epoch(datetime.fromisoformat(value))
+        return int(value)
+
+    @property
+    def created_at(self) -> datetime:
+        """ Creation time, as a naive UTC datetime
+        """
+        return snapshot.from_epoch(self._created_at)
+
+    @created_at.setter
+    def created_at(self, value):
+        """ Set the creation time from a datetime, string or epoch
+        """
+        self._created_at = self._epoch(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update time, as a naive UTC datetime
+        """
+        return snapshot.from_epoch(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value):
+        """ Set the last update time from a datetime, string or epoch
+        """
+        self._updated_at = self._epoch(value)
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -46,67 +116,235 @@ class Base():
 
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
+
+        The serialized form is cached until an attribute is set; callers
+        get a copy. Output built while an attribute was set is returned
+        but not cached.
         """
-        result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
+        cached = getattr(self, '_json', None)
+        if cached is None:
+            version = getattr(self, '_version', 0)
+            cached = {}
+            timestamps = self.timestamp_attributes
+            for key in self.serialized_attributes:
+                try:
+                    if key in timestamps:
+                        value = snapshot.format_epoch(
+                            getattr(self, '_' + key))
+                    else:
+                        value = getattr(self, key)
+                except AttributeError:
+                    continue
+                if type(value) is datetime:
+                    value = value.strftime(TIMESTAMP_FORMAT)
+                cached[key] = value
+            object.__setattr__(self, '_json', cached)
+            if getattr(self, '_version', 0) != version:
+                object.__setattr__(self, '_json', None)
+        if for_serialization:
+            return dict(cached)
+        return {key: value for key, value in cached.items()
+                if key[0] != '_'}
+
+    @classmethod
+    def _reset_indexes(cls):
+        """ Empty the secondary indexes of the class
+        """
+        s_class = cls.__name__
+        INDEXES[s_class] = {attr: {} for attr in cls.indexed_attributes}
+        INDEXED_VALUES[s_class] = {}
+
+    @classmethod
+    def _unindex_id(cls, obj_id: str):
+        """ Remove an object ID from the secondary indexes
+        """
+        s_class = cls.__name__
+        values = INDEXED_VALUES[s_class].pop(obj_id, {})
+        for attr, value in values.items():
+            ids = INDEXES[s_class][attr].get(value)
+            if ids is not None:
+                ids.discard(obj_id)
+                if not ids:
+                    del INDEXES[s_class][attr][value]
+
+    @classmethod
+    def _index_id(cls, obj_id: str, values: dict):
+        """ Add an object ID to the secondary indexes under given values
+        """
+        s_class = cls.__name__
+        cls._unindex_id(obj_id)
+        indexed = {}
+        for attr in cls.indexed_attributes:
+            value = values.get(attr)
+            try:
+                INDEXES[s_class][attr].setdefault(value, set()).add(obj_id)
+            except TypeError:
                 continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
-        return result
+            indexed[attr] = value
+        INDEXED_VALUES[s_class][obj_id] = indexed
+
+    def _unindex(self):
+        """ Remove the object from the secondary indexes
+        """
+        self.__class__._unindex_id(self.id)
+
+    def _index(self):
+        """ Add the object to the secondary indexes under current values
+        """
+        self.__class__._index_id(self.id, {
+            attr: getattr(self, attr, None)
+            for attr in self.__class__.indexed_attributes})
+
+    @classmethod
+    def store(cls) -> Store:
+        """ Store of the class
+        """
+        return get_store(cls.__name__)
+
+    @classmethod
+    def journal(cls) -> Journal:
+        """ Journal of the class, configured by STORAGE_FSYNC and
+        STORAGE_COMPACT_EVERY
+        """
+        s_class = cls.__name__
+        if JOURNALS.get(s_class) is None:
+            JOURNALS[s_class] = Journal(
+                ".db_{}.journal".format(s_class),
+                fsync=getenv('STORAGE_FSYNC', 'interval'),
+                compact_every=int(getenv('STORAGE_COMPACT_EVERY', '1000')))
+        return JOURNALS[s_class]
 
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal
+
+        With STORAGE_FORMAT=binary, the binary snapshot is read when it
+        exists (and, with STORAGE_LAZY=1, objects are built on first
+        access); the JSON file is read otherwise.
+        """
+        with cls.store().lock.write():
+            replayed = cls._load()
+        journal = cls.journal()
+        if replayed and STORAGE_MODE != 'journal':
+            cls.save_to_file()
+            journal.discard()
+        journal.pending = replayed
+
+    @classmethod
+    def _load(cls) -> int:
+        """ Read the snapshot and the journal; return the number of
+        journal records replayed
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
+        bin_path = ".db_{}.bin".format(s_class)
+        remove_stale_tmp(file_path)
+        remove_stale_tmp(bin_path)
         DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        cls._reset_indexes()
+        if STORAGE_FORMAT == 'binary' and path.exists(bin_path):
+            DATA[s_class] = snapshot.load(cls, bin_path, STORAGE_LAZY)
+        elif path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+                for obj_id, obj_json in objs_json.items():
+                    DATA[s_class][obj_id] = cls(**obj_json)
+        if isinstance(DATA[s_class], snapshot.LazyObjects):
+            for obj_id, values in DATA[s_class].indexed_values():
+                cls._index_id(obj_id, values)
+        else:
+            for obj in DATA[s_class].values():
+                obj._index()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        journal = cls.journal()
+        replayed = 0
+        for record in journal.records():
+            replayed += 1
+            if record['op'] == 'delete':
+                DATA[s_class].pop(record['id'], None)
+                cls._unindex_id(record['id'])
+            else:
+                obj = cls(**record['data'])
+                DATA[s_class][obj.id] = obj
+                obj._index()
+        return replayed
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+
+        Objects are serialized under the read lock, then the file is
+        written aside and renamed over the previous one, so a crash never
+        leaves a truncated snapshot.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        store = cls.store()
+        with store.flush_lock:
+            with store.lock.read():
+                if STORAGE_FORMAT == 'binary':
+                    file_path = ".db_{}.bin".format(s_class)
+                    data = snapshot.dumps(DATA[s_class].values(),
+                                          cls.indexed_attributes)
+                else:
+                    file_path = ".db_{}.json".format(s_class)
+                    objs_json = {}
+                    for obj_id, obj in DATA[s_class].items():
+                        objs_json[obj_id] = obj.to_json(True)
+                    data = json.dumps(objs_json).encode()
+            write_atomic(file_path, data)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _persist(cls, op: str, obj_id: str, data: dict = None):
+        """ Make a change durable; caller holds the write lock
+
+        In journal mode, the change is appended while the lock is held,
+        so records follow the order of the changes. Otherwise, the
+        snapshot write is left to _commit().
+        """
+        if STORAGE_MODE != 'journal':
+            return
+        journal = cls.journal()
+        if journal.append(op, obj_id, data):
+            journal.compact_in_background(cls.save_to_file)
+
+    @classmethod
+    def _commit(cls):
+        """ Write the snapshot through group commit, after the write lock
+        is released
+        """
+        if STORAGE_MODE != 'journal':
+            cls.store().commit(cls.save_to_file)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self.__class__.store().lock.write():
+            self.updated_at = int(time.time())
+            DATA[s_class][self.id] = self
+            self._index()
+            self.__class__._persist('upsert', self.id, self.to_json(True))
+        self.__class__._commit()
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
+        with self.__class__.store().lock.write():
+            if DATA[s_class].get(self.id) is None:
+                return
             del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+            self._unindex()
+            self.__class__._persist('delete', self.id)
+        self.__class__._commit()
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        with cls.store().lock.read():
+            return len(DATA[s_class])
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -119,11 +357,33 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        with cls.store().lock.read():
+            return DATA[s_class].get(id)
+
+    @classmethod
+    def _indexed_ids(cls, attributes: dict) -> Optional[Set[str]]:
+        """ IDs of the candidates for a search, from the smallest index
+        match, or None if no index covers the searched attributes
+        """
+        s_class = cls.__name__
+        candidates = None
+        for k, v in attributes.items():
+            index = INDEXES.get(s_class, {}).get(k)
+            if index is None:
+                continue
+            try:
+                ids = index.get(v, set())
+            except TypeError:
+                continue
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        return candidates
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Indexed attributes reflect the values objects had when last saved.
         """
         s_class = cls.__name__
         def _search(obj):
@@ -133,5 +393,11 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        with cls.store().lock.read():
+            ids = cls._indexed_ids(attributes)
+            if ids is None:
+                return list(filter(_search, DATA[s_class].values()))
+            objs = [DATA[s_class][obj_id] for obj_id in ids
+                    if obj_id in DATA[s_class]]
+            return list(filter(_search, objs))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+""" Journal module
+"""
+from os import path
+from typing import Callable, Iterator
+import atexit
+import json
+import os
+import threading
+import time
+
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class Journal():
+    """ Append-only log of upserts and tombstones for one class
+
+    Each line is a JSON record: {"op": "upsert", "id": ..., "data": ...}
+    or {"op": "delete", "id": ...}. Replaying the log over the snapshot
+    file rebuilds the current objects; compaction folds it back into the
+    snapshot.
+    """
+
+    def __init__(self, file_path: str, fsync: str = 'interval',
+                 fsync_interval: float = 1.0, compact_every: int = 1000):
+        """ Initialize a Journal instance
+
+        fsync is 'always' (every record), 'interval' (at most once every
+        fsync_interval seconds) or 'never' (left to the OS). A compaction
+        becomes due every compact_every records.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy: {}".format(fsync))
+        self.file_path = file_path
+        self.old_path = file_path + '.old'
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.pending = 0
+        self._file = None
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._compactor = None
+        atexit.register(self.close)
+
+    def _sync(self):
+        """ Flush the journal file and fsync it according to the policy
+        """
+        self._file.flush()
+        now = time.monotonic()
+        if self.fsync == 'always' or (
+                self.fsync == 'interval'
+                and now - self._last_sync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def append(self, op: str, obj_id: str, data: dict = None) -> bool:
+        """ Append a record; return True when a compaction is due
+        """
+        record = {'op': op, 'id': obj_id}
+        if data is not None:
+            record['data'] = data
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.file_path, 'a')
+            self._file.write(line)
+            self._sync()
+            self.pending += 1
+            return self.compact_every > 0 \
+                and self.pending >= self.compact_every
+
+    def records(self) -> Iterator[dict]:
+        """ Records of the rotated journal, then of the current one
+
+        A truncated last line, left by a crash mid-write, is skipped.
+        """
+        for file_path in (self.old_path, self.file_path):
+            if not path.exists(file_path):
+                continue
+            with open(file_path, 'r') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def _rotate(self):
+        """ Move the current records aside; caller holds the lock
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.pending = 0
+        if not path.exists(self.file_path):
+            return
+        if not path.exists(self.old_path):
+            os.replace(self.file_path, self.old_path)
+            return
+        # A previous compaction did not finish: keep its records too
+        with open(self.file_path, 'r') as src, \
+                open(self.old_path, 'a') as dst:
+            dst.write(src.read())
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(self.file_path)
+
+    def compact(self, write_snapshot: Callable[[], None]):
+        """ Fold the journal into the snapshot
+
+        The journal is rotated first, so appends go on while
+        write_snapshot() saves the current objects; the rotated records
+        are only dropped once the new snapshot is in place.
+        """
+        with self._compacting:
+            with self._lock:
+                self._rotate()
+            write_snapshot()
+            if path.exists(self.old_path):
+                os.remove(self.old_path)
+
+    def compact_in_background(self, write_snapshot: Callable[[], None]):
+        """ Start a compaction thread unless one is already running
+        """
+        if self._compacting.locked():
+            return
+        self._compactor = threading.Thread(
+            target=self.compact, args=(write_snapshot,), daemon=True)
+        self._compactor.start()
+
+    def discard(self):
+        """ Drop every record, once they are all in the snapshot
+        """
+        with self._lock:
+            self._rotate()
+            if path.exists(self.old_path):
+                os.remove(self.old_path)
+
+    def close(self):
+        """ Wait for a running compaction, then flush, fsync and close the
+        journal file; also run at interpreter exit
+        """
+        compactor = self._compactor
+        if compactor is not None \
+                and compactor is not threading.current_thread():
+            compactor.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                if self.fsync != 'never':
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+""" Snapshot module: compact binary snapshot files
+"""
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+import json
+import struct
+import threading
+
+
+MAGIC = b'HBNS\x01'
+LENGTH = struct.Struct('<I')
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+
+
+def to_epoch(value: datetime) -> int:
+    """ Naive UTC datetime to epoch seconds
+    """
+    return (value - EPOCH) // SECOND
+
+
+def from_epoch(value: int) -> datetime:
+    """ Epoch seconds to naive UTC datetime, much cheaper than strptime
+    """
+    return EPOCH + timedelta(seconds=value)
+
+
+@lru_cache(maxsize=4096)
+def format_epoch(value: int) -> str:
+    """ Epoch seconds as "%Y-%m-%dT%H:%M:%S"; objects saved in the same
+    second share the cached string
+    """
+    return from_epoch(value).isoformat()
+
+
+def dumps(objs: Iterable, indexed: Tuple[str, ...] = ()) -> bytes:
+    """ Serialize objects to a binary snapshot
+
+    The snapshot holds MAGIC, a length-prefixed JSON header (field names,
+    IDs and the values of the indexed attributes, in record order), then
+    one length-prefixed record per object: a compact JSON array of its
+    `serialized_attributes`, timestamps as epoch seconds.
+    """
+    objs = list(objs)
+    fields: List[str] = []
+    if objs:
+        fields = [field for field in objs[0].serialized_attributes
+                  if field != 'id']
+
+    header = {
+        'fields': fields,
+        'ids': [obj.id for obj in objs],
+        'columns': {attr: [getattr(obj, attr, None) for obj in objs]
+                    for attr in indexed},
+    }
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    chunks = [MAGIC]
+    data = encode(header).encode()
+    chunks.append(LENGTH.pack(len(data)) + data)
+    for obj in objs:
+        row = []
+        for field in fields:
+            value = getattr(obj, field, None)
+            if type(value) is datetime:
+                value = to_epoch(value)
+            row.append(value)
+        data = encode(row).encode()
+        chunks.append(LENGTH.pack(len(data)))
+        chunks.append(data)
+    return b''.join(chunks)
+
+
+def _read(file_path: str) -> Tuple[dict, bytes, List[Tuple[int, int]]]:
+    """ Header, raw content and record spans of a snapshot file
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a snapshot file: {}".format(file_path))
+    pos = len(MAGIC)
+    size, = LENGTH.unpack_from(data, pos)
+    pos += LENGTH.size
+    header = json.loads(data[pos:pos + size])
+    pos += size
+    spans = []
+    end = len(data)
+    unpack = LENGTH.unpack_from
+    while pos < end:
+        size, = unpack(data, pos)
+        pos += LENGTH.size
+        spans.append((pos, pos + size))
+        pos += size
+    if len(spans) != len(header['ids']):
+        raise ValueError("Truncated snapshot file: {}".format(file_path))
+    return header, data, spans
+
+
+def _builder(cls, header: dict) -> Callable:
+    """ Function building an object from its ID and decoded record,
+    without going through __init__
+
+    Timestamps are set as epoch seconds, which Base accepts as is.
+    """
+    fields = header['fields']
+    new = cls.__new__
+
+    def build(obj_id: str, row: list):
+        """ Build one object
+        """
+        obj = new(cls)
+        obj.id = obj_id
+        for field, value in zip(fields, row):
+            setattr(obj, field, value)
+        return obj
+
+    return build
+
+
+def load(cls, file_path: str, lazy: bool = False) -> Dict:
+    """ Objects of a binary snapshot, by ID
+
+    All records are decoded in one pass. With lazy=True, they are kept
+    raw instead and each object is built on first access.
+    """
+    header, data, spans = _read(file_path)
+    build = _builder(cls, header)
+    ids = header['ids']
+    if lazy:
+        return LazyObjects(build, data, ids, spans, header['columns'])
+    rows = json.loads(b'[' + b','.join(data[start:end]
+                                       for start, end in spans) + b']')
+    return {obj_id: build(obj_id, row) for obj_id, row in zip(ids, rows)}
+
+
+class LazyObjects(dict):
+    """ Objects by ID, built from their snapshot record on first access
+
+    Lookups by ID, membership and len() leave the other records raw;
+    values() and items() build every remaining object and return lists,
+    since concurrent readers may still be building objects.
+    """
+
+    def __init__(self, build: Callable, data: bytes, ids: List[str],
+                 spans: List[Tuple[int, int]], columns: Dict[str, list]):
+        """ Initialize a LazyObjects instance
+        """
+        super().__init__()
+        self._build = build
+        self._data = data
+        self._ids = ids
+        self._spans = dict(zip(ids, spans))
+        self._columns = columns
+        self._lock = threading.Lock()
+
+    def indexed_values(self) -> Iterator[Tuple[str, dict]]:
+        """ (ID, indexed attribute values) of every snapshot record,
+        read from the header without building objects
+        """
+        for i, obj_id in enumerate(self._ids):
+            yield obj_id, {attr: values[i]
+                           for attr, values in self._columns.items()}
+
+    def _hydrate(self, obj_id: str) -> bool:
+        """ Build a pending object; return False if there is none
+        """
+        with self._lock:
+            span = self._spans.pop(obj_id, None)
+            if span is None:
+                return dict.__contains__(self, obj_id)
+            row = json.loads(self._data[span[0]:span[1]])
+            dict.__setitem__(self, obj_id, self._build(obj_id, row))
+            if not self._spans:
+                self._data = b''
+            return True
+
+    def _hydrate_all(self):
+        """ Build every pending object
+        """
+        for obj_id in list(self._spans):
+            self._hydrate(obj_id)
+
+    def __getitem__(self, obj_id):
+        """ Object by ID
+        """
+        if obj_id in self._spans:
+            self._hydrate(obj_id)
+        return dict.__getitem__(self, obj_id)
+
+    def get(self, obj_id, default=None):
+        """ Object by ID, or default
+        """
+        if obj_id in self._spans:
+            self._hydrate(obj_id)
+        return dict.get(self, obj_id, default)
+
+    def __setitem__(self, obj_id, obj):
+        """ Store an object, replacing any pending record
+        """
+        with self._lock:
+            self._spans.pop(obj_id, None)
+            dict.__setitem__(self, obj_id, obj)
+
+    def __delitem__(self, obj_id):
+        """ Remove an object
+        """
+        if obj_id in self._spans:
+            self._hydrate(obj_id)
+        dict.__delitem__(self, obj_id)
+
+    def pop(self, obj_id, *default):
+        """ Remove and return an object
+        """
+        if obj_id in self._spans:
+            self._hydrate(obj_id)
+        return dict.pop(self, obj_id, *default)
+
+    def __contains__(self, obj_id) -> bool:
+        """ Whether an object exists, built or not
+        """
+        return obj_id in self._spans or dict.__contains__(self, obj_id)
+
+    def __len__(self) -> int:
+        """ Number of objects, built or not
+        """
+        return dict.__len__(self) + len(self._spans)
+
+    def __iter__(self):
+        """ IDs of every object
+        """
+        return iter(list(dict.keys(self)) + list(self._spans))
+
+    def keys(self):
+        """ IDs of every object
+        """
+        return list(self)
+
+    def values(self):
+        """ Every object, building the pending ones
+        """
+        self._hydrate_all()
+        with self._lock:
+            return list(dict.values(self))
+
+    def items(self):
+        """ (ID, object) pairs, building the pending objects
+        """
+        self._hydrate_all()
+        with self._lock:
+            return list(dict.items(self))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+""" Store module: locking and persistence of the objects of a class
+"""
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import os
+import threading
+import time
+
+
+class RWLock():
+    """ Readers-writer lock
+
+    Any number of readers, or a single writer, hold the lock. Waiting
+    writers block new readers, so a stream of reads cannot starve them.
+    The lock is not reentrant.
+    """
+
+    def __init__(self):
+        """ Initialize a RWLock instance
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """ Hold the lock shared
+        """
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """ Hold the lock exclusively
+        """
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def write_atomic(file_path: str, data: bytes):
+    """ Replace a file with data, never leaving it half written
+
+    The data goes to a temporary file in the same directory, is fsynced,
+    then renamed over the target.
+    """
+    tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                     threading.get_ident())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _alive(pid: int) -> bool:
+    """ Whether a process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_tmp(file_path: str):
+    """ Delete temporary files that write_atomic() left for file_path in
+    processes that died mid-write
+    """
+    directory = os.path.dirname(file_path) or '.'
+    prefix = os.path.basename(file_path) + '.'
+    for name in os.listdir(directory):
+        if not name.startswith(prefix) or not name.endswith('.tmp'):
+            continue
+        try:
+            pid = int(name[len(prefix):].split('.')[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _alive(pid):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class Store():
+    """ Concurrency control for the objects of one class
+
+    `lock` guards the in-memory objects and indexes: readers share it,
+    save() and remove() take it exclusively. `flush_lock` orders snapshot
+    writes. commit() implements group commit: the first writer to commit
+    becomes the leader, waits `window` seconds for others to join, then
+    flushes once for all of them; writers arriving during a flush are
+    covered by the next one.
+    """
+
+    def __init__(self, window: float = 0.002):
+        """ Initialize a Store instance
+        """
+        self.lock = RWLock()
+        self.flush_lock = threading.Lock()
+        self.window = window
+        self.flushes = 0
+        self._cond = threading.Condition()
+        self._requested = 0
+        self._flushed = 0
+        self._flushing = False
+
+    def commit(self, flush: Callable[[], None]):
+        """ Return once a flush started after this call has completed
+
+        If the leader's flush fails, it raises and another waiting writer
+        takes over.
+        """
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+            while self._flushed < ticket:
+                if not self._flushing:
+                    self._flushing = True
+                    break
+                self._cond.wait()
+            else:
+                return
+
+        flushed = False
+        try:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self._cond:
+                target = self._requested
+            flush()
+            flushed = True
+        finally:
+            with self._cond:
+                self._flushing = False
+                if flushed:
+                    self._flushed = max(self._flushed, target)
+                    self.flushes += 1
+                self._cond.notify_all()
+
+
+STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_store(name: str) -> Store:
+    """ Store of a class, created on first use with the group commit
+    window from STORAGE_COMMIT_WINDOW (seconds)
+    """
+    with _STORES_LOCK:
+        if STORES.get(name) is None:
+            STORES[name] = Store(
+                float(os.getenv('STORAGE_COMMIT_WINDOW', '0.002')))
+        return STORES[name]
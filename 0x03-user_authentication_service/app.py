@@ -2,11 +2,27 @@
 """
 Basic Flask app
 """
-from flask import Flask, jsonify, request, abort, redirect
-from auth import Auth
+import json
+import os
+from flask import (Flask, Response, jsonify, request, abort, redirect,
+                   stream_with_context)
+from auth import Auth, MissingCredentials
+from hashing import ExecutorSaturated, HashingExecutor
 
 app = Flask(__name__)
 AUTH = Auth()
+HASHER = HashingExecutor(
+    workers=int(os.getenv("AUTH_HASH_WORKERS", "4")),
+    queue_limit=int(os.getenv("AUTH_HASH_QUEUE", "32")),
+    timeout=float(os.getenv("AUTH_HASH_TIMEOUT", "5")),
+    teardown=AUTH.teardown
+)
+
+
+@app.teardown_appcontext
+def teardown_db(exception) -> None:
+    """Release the request's database session"""
+    AUTH.teardown()
 
 
 @app.route('/', methods=['GET'], strict_slashes=False)
@@ -22,19 +38,54 @@ def users() -> str:
     password = request.form.get('password')
 
     try:
-        AUTH.register_user(email, password)
+        HASHER.run('/users', AUTH.register_user, email, password)
         return jsonify({"email": email, "message": "user created"})
+    except MissingCredentials:
+        return jsonify({"message": "email and password required"}), 400
     except ValueError:
         return jsonify({"message": "email already registered"}), 400
 
 
+@app.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def bulk_users() -> Response:
+    """
+    Register users from an NDJSON body of {"email", "password"} objects
+
+    Streams back one NDJSON result per input line, in order. Passwords
+    are hashed on the shared bounded executor; if it stays saturated, the
+    stream ends with an {"error": ...} line and the remaining input is
+    not registered.
+    """
+    def credentials():
+        """Parse the request body line by line"""
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                yield row.get('email'), row.get('password')
+            except (ValueError, AttributeError):
+                yield None, None
+
+    def results():
+        """Serialize registration results as they are produced"""
+        try:
+            for result in AUTH.register_users(credentials(), hasher=HASHER):
+                yield json.dumps(result) + "\n"
+        except ExecutorSaturated:
+            yield json.dumps({"error": "hashing capacity exhausted"}) + "\n"
+
+    return Response(stream_with_context(results()),
+                    mimetype='application/x-ndjson')
+
+
 @app.route('/sessions', methods=['POST'], strict_slashes=False)
 def login() -> str:
     """Login user"""
     email = request.form.get('email')
     password = request.form.get('password')
 
-    if not AUTH.valid_login(email, password):
+    if not HASHER.run('/sessions', AUTH.valid_login, email, password):
         abort(401)
 
     session_id = AUTH.create_session(email)
@@ -51,7 +102,7 @@ def logout() -> str:
     if user is None:
         abort(403)
 
-    AUTH.destroy_session(user.id)
+    AUTH.destroy_session(user.id, session_id)
     return redirect('/')
 
 
@@ -84,11 +135,27 @@ def update_password() -> str:
     new_password = request.form.get('new_password')
 
     try:
-        AUTH.update_password(reset_token, new_password)
+        HASHER.run('/reset_password', AUTH.update_password,
+                   reset_token, new_password)
         return jsonify({"email": email, "message": "Password updated"})
     except ValueError:
         abort(403)
 
 
+@app.route('/metrics', methods=['GET'], strict_slashes=False)
+def metrics() -> str:
+    """Hashing executor and session cache metrics"""
+    return jsonify({
+        "hashing": HASHER.metrics(),
+        "session_cache": AUTH.session_cache_stats(),
+    })
+
+
+@app.errorhandler(ExecutorSaturated)
+def hashing_saturated(error) -> str:
+    """Hashing executor is saturated"""
+    return jsonify({"message": "service busy, retry later"}), 503
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port="5000")
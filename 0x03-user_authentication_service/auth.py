@@ -3,25 +3,138 @@
 Authentication module
 """
 import bcrypt
+import hashlib
+import logging
+import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from db import DB
+from hashing import HashingExecutor
+from session_cache import SessionCache
+from session_store import make_session_store
+from tokens import RevocationList, signer_from_env
 from user import User
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
-from typing import Union
+from typing import (Callable, Dict, Iterable, Iterator, List, Tuple,
+                    Union)
 
 
-def _hash_password(password: str) -> bytes:
+DEFAULT_ROUNDS = 12
+
+
+class MissingCredentials(ValueError):
+    """Raised when an email or password is missing or empty"""
+
+
+def _hash_password(password: str,
+                   rounds: int = DEFAULT_ROUNDS) -> bytes:
     """
     Hash password using bcrypt
     Args:
         password: Password to hash
+        rounds: bcrypt cost factor
     Returns:
         bytes: Hashed password
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds)
     return bcrypt.hashpw(password.encode('utf-8'), salt)
 
 
+def _calibrate_rounds(target_ms: float, min_rounds: int = 4,
+                      max_rounds: int = 16) -> int:
+    """
+    Find the highest bcrypt cost that hashes within a latency budget
+
+    Same policy as calibrate_rounds in 0x00-personal_data's
+    encrypt_password, which this service does not ship with.
+
+    Args:
+        target_ms: Hashing latency budget in milliseconds
+        min_rounds: Lowest acceptable cost factor
+        max_rounds: Highest cost factor to consider
+
+    Returns:
+        int: Cost factor measured on this host
+    """
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+        if (time.perf_counter() - start) * 1000 > target_ms:
+            break
+        chosen = rounds
+    return chosen
+
+
+def _bcrypt_rounds() -> int:
+    """
+    Resolve the bcrypt cost policy from the environment
+
+    AUTH_BCRYPT_ROUNDS pins the cost factor; otherwise, when
+    AUTH_BCRYPT_TARGET_MS is set, the cost is calibrated on this host
+    to fit that latency budget. Defaults to DEFAULT_ROUNDS, bcrypt's
+    own default cost.
+
+    Returns:
+        int: Cost factor for new hashes
+    """
+    if os.getenv("AUTH_BCRYPT_ROUNDS"):
+        return int(os.getenv("AUTH_BCRYPT_ROUNDS"))
+    if os.getenv("AUTH_BCRYPT_TARGET_MS"):
+        return _calibrate_rounds(float(os.getenv("AUTH_BCRYPT_TARGET_MS")))
+    return DEFAULT_ROUNDS
+
+
+def _hash_rounds(hashed_password: bytes) -> int:
+    """
+    Read the cost factor stored in a bcrypt hash, as hash_rounds in
+    encrypt_password does
+
+    Args:
+        hashed_password: Hash such as b"$2b$12$..."
+
+    Returns:
+        int: The hash's cost factor
+    """
+    return int(hashed_password.split(b"$")[2])
+
+
+def _snapshot(user: User) -> User:
+    """
+    Copy a user into a transient object that outlives its DB session
+
+    Args:
+        user: Persistent User object
+
+    Returns:
+        User: Unattached User with the same column values
+    """
+    return User(**{column.key: getattr(user, column.key)
+                   for column in User.__table__.columns})
+
+
+def _hash_token(token: str) -> str:
+    """
+    Digest a reset token for storage
+
+    Tokens are random UUIDs, so a fast hash is enough to make a leaked
+    digest useless.
+
+    Args:
+        token: Reset token
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
 def _generate_uuid() -> str:
     """
     Generate a new UUID
@@ -32,16 +145,111 @@ def _generate_uuid() -> str:
     return str(uuid.uuid4())
 
 
+class _KnownEmails:
+    """Bounded, thread-safe LRU set of emails known to be registered"""
+
+    def __init__(self, maxsize: int) -> None:
+        """Initialize an empty set holding at most `maxsize` emails"""
+        self._maxsize = maxsize
+        self._emails: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, email: str) -> bool:
+        """Tell whether the email was seen registered"""
+        with self._lock:
+            if email in self._emails:
+                self._emails.move_to_end(email)
+                return True
+            return False
+
+    def add(self, email: str) -> None:
+        """Remember a registered email"""
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._emails[email] = None
+            self._emails.move_to_end(email)
+            if len(self._emails) > self._maxsize:
+                self._emails.popitem(last=False)
+
+
 class Auth:
     """Auth class to interact with the authentication database"""
 
     def __init__(self):
         """Initialize Auth instance"""
         self._db = DB()
+        self._rounds = _bcrypt_rounds()
+        self._store = make_session_store(self._db)
+        self._known_emails = _KnownEmails(
+            int(os.getenv("AUTH_EMAIL_CACHE_SIZE", "100000")))
+        self._signer = None
+        if os.getenv("AUTH_SESSION_MODE", "store") == "signed":
+            self._signer = signer_from_env()
+            self._revoked = RevocationList(self._signer.ttl)
+        self._sessions = SessionCache(
+            maxsize=int(os.getenv("AUTH_SESSION_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("AUTH_SESSION_CACHE_TTL", "5"))
+        )
+        self._reset_ttl = timedelta(
+            seconds=float(os.getenv("AUTH_RESET_TOKEN_TTL", "3600")))
+        sweep_interval = float(os.getenv("AUTH_RESET_SWEEP_INTERVAL", "300"))
+        if sweep_interval > 0:
+            threading.Thread(target=self._sweep_reset_tokens,
+                             args=(sweep_interval,), daemon=True).start()
+
+    def purge_expired_reset_tokens(self, batch_size: int = 1000) -> int:
+        """
+        Delete expired reset tokens, one batch per transaction
+
+        Args:
+            batch_size: Tokens deleted per transaction
+
+        Returns:
+            int: Number of deleted tokens
+        """
+        now = datetime.utcnow()
+        total = 0
+        try:
+            while True:
+                count = self._db.purge_reset_tokens(now, batch_size)
+                total += count
+                if count < batch_size:
+                    return total
+        finally:
+            self._db.remove_session()
+
+    def _sweep_reset_tokens(self, interval: float) -> None:
+        """Background loop purging expired reset tokens"""
+        while True:
+            time.sleep(interval)
+            try:
+                self.purge_expired_reset_tokens()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Purging expired reset tokens failed")
+
+    def session_cache_stats(self) -> dict:
+        """
+        Session cache counters
+
+        Returns:
+            dict: Size, hits, misses and evictions of the session cache
+        """
+        return self._sessions.stats()
+
+    def teardown(self) -> None:
+        """Release the database session used by the current thread"""
+        self._db.remove_session()
 
     def register_user(self, email: str, password: str) -> User:
         """
         Register a new user
+
+        Uniqueness is enforced by the database's unique email index, so
+        registration is a single INSERT. Emails already seen registered
+        are rejected before spending time on bcrypt.
+
         Args:
             email: User's email
             password: User's password
@@ -49,19 +257,123 @@ class Auth:
             User: New User object
 
         Raises:
+            MissingCredentials: If email or password is missing or empty
             ValueError: If user already exists
+            IntegrityError: If the INSERT fails for another reason
         """
+        if not isinstance(email, str) or not isinstance(password, str) \
+                or not email or not password:
+            raise MissingCredentials("email and password are required")
+        if email in self._known_emails:
+            raise ValueError(f"User {email} already exists")
+        hashed_password = _hash_password(password, self._rounds)
         try:
-            self._db.find_user_by(email=email)
+            user = self._db.add_user(email, hashed_password)
+        except IntegrityError:
+            if not self._db.existing_emails([email]):
+                raise
+            self._known_emails.add(email)
             raise ValueError(f"User {email} already exists")
-        except NoResultFound:
-            hashed_password = _hash_password(password)
-            return self._db.add_user(email, hashed_password)
+        self._known_emails.add(email)
+        return user
+
+    def register_users(self, credentials: Iterable[Tuple[str, str]],
+                       chunk_size: int = 500, workers: int = None,
+                       hasher: HashingExecutor = None,
+                       route: str = "/users/bulk"
+                       ) -> Iterator[Dict[str, str]]:
+        """
+        Register many users, chunk by chunk
+
+        Each chunk costs one IN query to find already registered emails,
+        parallel bcrypt hashing of the new passwords, and one bulk insert.
+
+        Args:
+            credentials: (email, password) pairs
+            chunk_size: Pairs processed per chunk
+            workers: Hashing threads when no hasher is given, defaults
+                to the CPU count
+            hasher: Shared bounded executor to hash on, e.g. the app's;
+                its metrics are recorded under `route`
+            route: Metrics label used with `hasher`
+
+        Returns:
+            Iterator[dict]: One result per pair, in input order, with the
+            email and a status of "created", "exists" or "invalid"
+
+        Raises:
+            ExecutorSaturated: If `hasher` has no capacity in time
+        """
+        iterator = iter(credentials)
+        hash_one = partial(_hash_password, rounds=self._rounds)
+        if hasher is not None:
+            def hash_many(passwords):
+                """Hash on the shared executor"""
+                return hasher.map(route, hash_one, passwords)
+            yield from self._register_chunks(iterator, chunk_size, hash_many)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from self._register_chunks(
+                iterator, chunk_size, partial(pool.map, hash_one))
+
+    def _register_chunks(self, iterator: Iterator[Tuple[str, str]],
+                         chunk_size: int,
+                         hash_many: Callable[[Iterable[str]],
+                                             Iterable[bytes]]
+                         ) -> Iterator[Dict[str, str]]:
+        """Register pairs chunk by chunk with the given hashing function"""
+        while True:
+            chunk = [pair for _, pair in zip(range(chunk_size), iterator)]
+            if not chunk:
+                return
+            yield from self._register_chunk(chunk, hash_many)
+
+    def _register_chunk(self, chunk: List[Tuple[str, str]],
+                        hash_many: Callable[[Iterable[str]],
+                                            Iterable[bytes]]
+                        ) -> List[Dict[str, str]]:
+        """Register one chunk of (email, password) pairs"""
+        emails = {email for email, _ in chunk if isinstance(email, str)}
+        taken = self._db.existing_emails(emails)
+        for email in taken:
+            self._known_emails.add(email)
+        statuses, new = [], {}
+        for email, password in chunk:
+            if not isinstance(email, str) or not isinstance(password, str) \
+                    or not email or not password:
+                statuses.append("invalid")
+            elif email in taken or email in new:
+                statuses.append("exists")
+            else:
+                new[email] = password
+                statuses.append("created")
+
+        hashes = list(hash_many(new.values()))
+        rows = [{"email": email, "hashed_password": hashed}
+                for email, hashed in zip(new, hashes)]
+        try:
+            self._db.add_users(rows, chunk_size=len(rows) or 1)
+        except IntegrityError:
+            for row in rows:
+                try:
+                    self._db.add_users([row])
+                except IntegrityError:
+                    new.pop(row["email"])
+            statuses = ["exists" if status == "created"
+                        and email not in new else status
+                        for (email, _), status in zip(chunk, statuses)]
+        for email in new:
+            self._known_emails.add(email)
+        return [{"email": email, "status": status}
+                for (email, _), status in zip(chunk, statuses)]
 
     def valid_login(self, email: str, password: str) -> bool:
         """
         Validate user login credentials
 
+        On success, a stored hash made with a different cost than the
+        current policy is transparently replaced with one that matches it.
+
         Args:
             email: User's email
             password: User's password
@@ -71,10 +383,18 @@ class Auth:
         """
         try:
             user = self._db.find_user_by(email=email)
-            return bcrypt.checkpw(
+            if not bcrypt.checkpw(
                 password.encode('utf-8'),
                 user.hashed_password
-            )
+            ):
+                return False
+            if _hash_rounds(user.hashed_password) != self._rounds:
+                self._db.update_user(
+                    user.id,
+                    hashed_password=_hash_password(password, self._rounds)
+                )
+                self._sessions.invalidate_user(user.id)
+            return True
         except NoResultFound:
             return False
 
@@ -82,6 +402,10 @@ class Auth:
         """
         Create a session for the user
 
+        Sessions are kept in the store selected by AUTH_SESSION_STORE,
+        or, when AUTH_SESSION_MODE is "signed", are self-contained signed
+        tokens that need no storage.
+
         Args:
             email: User's email
 
@@ -89,18 +413,29 @@ class Auth:
             str: Session ID if user exists
             None: If user does not exist
         """
-        try:
-            user = self._db.find_user_by(email=email)
-            session_id = _generate_uuid()
-            self._db.update_user(user.id, session_id=session_id)
-            return session_id
-        except NoResultFound:
+        if self._signer is not None:
+            try:
+                user = self._db.find_user_by(email=email)
+            except NoResultFound:
+                return None
+            return self._signer.issue(user.id, user.email)
+
+        session_id = _generate_uuid()
+        updated = self._store.create_for_email(self._db, session_id, email)
+        self._sessions.invalidate_user(email=email)
+        if not updated:
             return None
+        return session_id
 
     def get_user_from_session_id(self, session_id: str) -> Union[User, None]:
         """
         Get user from session ID
 
+        Lookups are served from the session cache when possible; the
+        returned user is then a detached snapshot. Signed tokens are
+        verified without touching the database and yield a detached user
+        carrying only the id and email from the token.
+
         Args:
             session_id: Session ID to look up
 
@@ -111,30 +446,53 @@ class Auth:
         if session_id is None:
             return None
 
-        try:
-            user = self._db.find_user_by(session_id=session_id)
+        if self._signer is not None:
+            claims = self._signer.verify(session_id)
+            if claims is None or self._revoked.is_revoked(claims):
+                return None
+            return User(id=claims["user_id"], email=claims["email"])
+
+        user = self._sessions.get(session_id)
+        if user is not None:
             return user
-        except NoResultFound:
+        generation = self._sessions.generation
+        user = self._store.get_user(self._db, session_id)
+        if user is None:
             return None
+        self._sessions.put(session_id, _snapshot(user), generation)
+        return user
 
-    def destroy_session(self, user_id: int) -> None:
+    def destroy_session(self, user_id: int, session_id: str = None) -> None:
         """
         Destroy a user's session
 
         Args:
             user_id: ID of user whose session to destroy
+            session_id: Only destroy this session; by default every
+                session of the user is destroyed
         """
-        try:
-            self._db.update_user(user_id, session_id=None)
-        except NoResultFound:
-            pass
+        if self._signer is not None:
+            claims = self._signer.verify(session_id or "")
+            if claims is not None and claims["user_id"] == user_id:
+                self._revoked.revoke(claims)
+            else:
+                self._revoked.revoke_user(user_id)
+        elif session_id is None:
+            self._store.delete_user(user_id)
+            self._sessions.invalidate_user(user_id)
+        else:
+            self._store.delete(session_id)
+            self._sessions.invalidate(session_id)
 
     def get_reset_password_token(self, email: str) -> str:
         """
-        Generate reset password toke
+        Generate reset password token
+
+        Only the token's digest is stored, and it expires after
+        AUTH_RESET_TOKEN_TTL seconds.
 
         Args:
-            email: User's emai
+            email: User's email
 
         Returns:
             str: Reset token
@@ -144,30 +502,42 @@ class Auth:
         """
         try:
             user = self._db.find_user_by(email=email)
-            reset_token = _generate_uuid()
-            self._db.update_user(user.id, reset_token=reset_token)
-            return reset_token
         except NoResultFound:
             raise ValueError
+        reset_token = _generate_uuid()
+        self._db.add_reset_token(user.id, _hash_token(reset_token),
+                                 datetime.utcnow() + self._reset_ttl)
+        return reset_token
 
     def update_password(self, reset_token: str, new_password: str) -> None:
         """
         Update user's password
 
+        The token is looked up first so that unknown or expired tokens
+        are rejected before hashing; it is then consumed atomically with
+        the password change, so it can only be redeemed once.
+
         Args:
             reset_token: Reset token
             new_password: New password
 
         Raises:
-            ValueError: If reset token is invalid
+            ValueError: If reset token is invalid, expired or already used
         """
+        if reset_token is None:
+            raise ValueError
+        token_hash = _hash_token(reset_token)
+        try:
+            token = self._db.find_reset_token(token_hash)
+        except NoResultFound:
+            raise ValueError
+        if token.expires_at < datetime.utcnow():
+            raise ValueError
+        user_id = token.user_id
+        hashed_password = _hash_password(new_password, self._rounds)
         try:
-            user = self._db.find_user_by(reset_token=reset_token)
-            hashed_password = _hash_password(new_password)
-            self._db.update_user(
-                user.id,
-                hashed_password=hashed_password,
-                reset_token=None
-            )
+            self._db.redeem_reset_token(token_hash, user_id,
+                                        datetime.utcnow(), hashed_password)
         except NoResultFound:
             raise ValueError
+        self._sessions.invalidate_user(user_id)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark harness for the authentication service
+
+Drives register/login/profile/logout/reset flows against the Flask app,
+either in-process through the test client or through a local WSGI server,
+and saves per-route throughput, latency percentiles and DB query counts
+as JSON.
+
+Usage: python3 bench_app.py [--mode client|server] [--concurrency N]
+                            [--users N] [--flows N] [--output FILE]
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+
+class _TestClient:
+    """Issue requests through Flask's in-process test client"""
+
+    def __init__(self, app) -> None:
+        """Wrap a Flask app"""
+        self._client = app.test_client(use_cookies=False)
+
+    def request(self, method: str, path: str, data: dict = None,
+                session_id: str = None) -> Tuple[int, dict, Optional[str]]:
+        """Return status, JSON body and session cookie of a request"""
+        headers = {"Cookie": "session_id=" + session_id} if session_id \
+            else {}
+        resp = self._client.open(path, method=method, data=data,
+                                 headers=headers)
+        return resp.status_code, resp.get_json(silent=True), \
+            _session_cookie(resp.headers.get("Set-Cookie"))
+
+
+class _HTTPClient:
+    """Issue requests to a running server over a keep-alive connection"""
+
+    def __init__(self, host: str, port: int) -> None:
+        """Connect lazily to host:port"""
+        self._conn = http.client.HTTPConnection(host, port)
+
+    def request(self, method: str, path: str, data: dict = None,
+                session_id: str = None) -> Tuple[int, dict, Optional[str]]:
+        """Return status, JSON body and session cookie of a request"""
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if session_id:
+            headers["Cookie"] = "session_id=" + session_id
+        self._conn.request(method, path, body=body, headers=headers)
+        resp = self._conn.getresponse()
+        raw = resp.read()
+        try:
+            payload = json.loads(raw) if raw else None
+        except ValueError:
+            payload = None
+        return resp.status, payload, \
+            _session_cookie(resp.getheader("Set-Cookie"))
+
+
+def _session_cookie(header: Optional[str]) -> Optional[str]:
+    """Extract session_id from a Set-Cookie header"""
+    if not header or not header.startswith("session_id="):
+        return None
+    return header.split(";", 1)[0][len("session_id="):]
+
+
+class _Recorder:
+    """Thread-safe collection of per-route latencies"""
+
+    def __init__(self) -> None:
+        """Start with no samples"""
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def timed(self, client, route: str, expected: int, *args, **kwargs):
+        """Issue one request and record its latency under `route`"""
+        start = time.perf_counter()
+        status, payload, cookie = client.request(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if status != expected:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return payload, cookie
+
+
+def _flow(client, recorder: _Recorder, email: str) -> None:
+    """One user's register/login/profile/logout/reset sequence"""
+    record = recorder.timed
+    record(client, "POST /users", 200, "POST", "/users",
+           {"email": email, "password": "pwd"})
+    _, session_id = record(client, "POST /sessions", 200, "POST",
+                           "/sessions", {"email": email, "password": "pwd"})
+    record(client, "GET /profile", 200, "GET", "/profile",
+           session_id=session_id)
+    record(client, "DELETE /sessions", 302, "DELETE", "/sessions",
+           session_id=session_id)
+    payload, _ = record(client, "POST /reset_password", 200, "POST",
+                        "/reset_password", {"email": email})
+    token = (payload or {}).get("reset_token", "")
+    record(client, "PUT /reset_password", 200, "PUT", "/reset_password",
+           {"email": email, "reset_token": token, "new_password": "new"})
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted samples, in milliseconds"""
+    index = max(0, min(len(ordered) - 1,
+                       int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index] * 1000
+
+
+def _count_queries(engine, make_client, recorder: _Recorder) -> Dict:
+    """Run one flow alone and attribute SQL statements to routes"""
+    from sqlalchemy import event
+
+    counter = [0]
+
+    def count(*args) -> None:
+        """Count one statement"""
+        counter[0] += 1
+
+    counts: Dict[str, int] = {}
+    original = recorder.timed
+
+    def timed(client, route, *args, **kwargs):
+        """Measure the statements issued while a request runs"""
+        before = counter[0]
+        result = original(client, route, *args, **kwargs)
+        counts[route] = counter[0] - before
+        return result
+
+    event.listen(engine, "before_cursor_execute", count)
+    recorder.timed = timed
+    try:
+        _flow(make_client(), recorder, "query-count@bench")
+    finally:
+        recorder.timed = original
+        event.remove(engine, "before_cursor_execute", count)
+    return counts
+
+
+def run(mode: str, concurrency: int, users: int, flows: int) -> Dict:
+    """
+    Run the benchmark against a fresh database
+
+    Args:
+        mode: "client" for the Flask test client, "server" for a local
+            threaded WSGI server
+        concurrency: Number of concurrent simulated clients
+        users: Users registered before measuring
+        flows: Flows run by each client
+
+    Returns:
+        dict: Configuration, overall throughput and per-route statistics
+    """
+    import app as service
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        """Request handler without per-request access logs"""
+
+        def log_request(self, *args) -> None:
+            """Skip access logging"""
+
+    auth = service.AUTH
+    list(auth.register_users(("seed{}@bench".format(i), "pwd")
+                             for i in range(users)))
+    auth.teardown()
+
+    server = None
+    if mode == "server":
+        server = make_server("127.0.0.1", 0, service.app, threaded=True,
+                             request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def make_client():
+            """New keep-alive connection to the local server"""
+            return _HTTPClient("127.0.0.1", server.server_port)
+    else:
+        def make_client():
+            """New in-process test client"""
+            return _TestClient(service.app)
+
+    try:
+        queries = _count_queries(auth._db._engine, make_client, _Recorder())
+        recorder = _Recorder()
+
+        def worker(index: int) -> None:
+            """Run this client's flows"""
+            client = make_client()
+            for flow in range(flows):
+                _flow(client, recorder,
+                      "user{}-{}@bench".format(index, flow))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    routes = {}
+    total = 0
+    for route, samples in recorder.latencies.items():
+        ordered = sorted(samples)
+        total += len(ordered)
+        routes[route] = {
+            "requests": len(ordered),
+            "errors": recorder.errors.get(route, 0),
+            "throughput_rps": len(ordered) / elapsed,
+            "p50_ms": _percentile(ordered, 50),
+            "p95_ms": _percentile(ordered, 95),
+            "p99_ms": _percentile(ordered, 99),
+            "queries_per_request": queries.get(route),
+        }
+    return {
+        "config": {"mode": mode, "concurrency": concurrency,
+                   "users": users, "flows": flows,
+                   "bcrypt_rounds": auth._rounds},
+        "commit": _commit(),
+        "seconds": elapsed,
+        "throughput_rps": total / elapsed,
+        "routes": routes,
+    }
+
+
+def _commit() -> Optional[str]:
+    """Current git commit, to compare results across revisions"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    """Parse arguments, configure the service and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("client", "server"),
+                        default="client")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=1000,
+                        help="users registered before measuring")
+    parser.add_argument("--flows", type=int, default=10,
+                        help="flows run by each concurrent client")
+    parser.add_argument("--rounds", type=int, default=4,
+                        help="bcrypt cost factor used by the service")
+    parser.add_argument("--output",
+                        help="also save the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["AUTH_DB_URL"] = "sqlite:///" + os.path.join(tmp,
+                                                                "bench.db")
+        os.environ.setdefault("AUTH_BCRYPT_ROUNDS", str(args.rounds))
+        os.environ.setdefault("AUTH_RESET_SWEEP_INTERVAL", "0")
+        os.environ.setdefault("AUTH_HASH_QUEUE", str(args.concurrency * 4))
+        results = run(args.mode, args.concurrency, args.users, args.flows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark email and session_id lookups before and after indexing
+
+Usage: python3 bench_lookup.py [size ...]   (default: 10000 100000 1000000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import migrate
+from user import Base, User
+
+
+def _populate(engine, size: int) -> List[Dict[str, str]]:
+    """Create an unindexed users table holding `size` rows"""
+    Base.metadata.create_all(engine)
+    for index in User.__table__.indexes:
+        index.drop(engine)
+    rows = [
+        {"email": "user{}@example.com".format(i),
+         "hashed_password": "x",
+         "session_id": str(uuid.uuid4()) if i % 2 else None}
+        for i in range(size)
+    ]
+    with engine.begin() as conn:
+        for start in range(0, size, 50000):
+            conn.execute(User.__table__.insert(), rows[start:start + 50000])
+    return rows
+
+
+def _time_lookups(session, column: str, values: List[str]) -> float:
+    """Average milliseconds per find_user_by-style query"""
+    start = time.perf_counter()
+    for value in values:
+        session.query(User).filter_by(**{column: value}).first()
+    return (time.perf_counter() - start) / len(values) * 1000
+
+
+def bench(size: int, lookups: int = 200) -> None:
+    """Print lookup latency for one dataset size, unindexed then indexed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine("sqlite:///" + os.path.join(tmp, "bench.db"))
+        rows = _populate(engine, size)
+        sample = random.sample(rows, min(lookups, size))
+        emails = [row["email"] for row in sample]
+        sessions = [row["session_id"] or "missing" for row in sample]
+        session = sessionmaker(bind=engine)()
+
+        before = (_time_lookups(session, "email", emails),
+                  _time_lookups(session, "session_id", sessions))
+        migrate(engine)
+        after = (_time_lookups(session, "email", emails),
+                 _time_lookups(session, "session_id", sessions))
+        session.close()
+        engine.dispose()
+
+    print("{:>9} users  email {:8.3f} -> {:6.3f} ms  "
+          "session_id {:8.3f} -> {:6.3f} ms".format(
+              size, before[0], after[0], before[1], after[1]))
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        bench(size)
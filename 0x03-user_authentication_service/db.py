@@ -2,33 +2,230 @@
 """
 Database module
 """
-from sqlalchemy import create_engine
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Set
+from sqlalchemy import (and_, create_engine, event, func, inspect, select,
+                        update)
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.orm.session import Session
-from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
 
-from user import Base, User
+from user import Base, ResetToken, User
+
+
+@lru_cache(maxsize=None)
+def _user_columns() -> FrozenSet[str]:
+    """Names of the User mapper's columns, read from the mapper once"""
+    return frozenset(column.key for column in inspect(User).column_attrs)
+
+
+def _schema_is_current(engine: Engine) -> bool:
+    """
+    Tell whether every table and index of the model already exists
+
+    Args:
+        engine: Engine bound to the database to check
+
+    Returns:
+        bool: True if no DDL is needed
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            return False
+        existing = {index['name'] for index in inspector.get_indexes(
+            table.name)}
+        if any(index.name not in existing for index in table.indexes):
+            return False
+    return True
+
+
+class MigrationError(Exception):
+    """Raised when existing data prevents a schema migration"""
+
+
+def _duplicates(engine: Engine, index, limit: int = 10) -> List[tuple]:
+    """
+    Find values that would violate a unique index about to be created
+
+    Args:
+        engine: Engine bound to the database to check
+        index: Unique index of the model
+        limit: Maximum number of duplicated values returned
+
+    Returns:
+        list: (values..., count) rows of duplicated non-NULL values
+    """
+    columns = list(index.columns)
+    query = select(*columns, func.count()).where(
+        and_(*(column.isnot(None) for column in columns))).group_by(
+        *columns).having(func.count() > 1).limit(limit)
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(query)]
+
+
+def migrate(engine: Engine) -> None:
+    """
+    Bring an existing database up to the current schema
+
+    create_all only creates missing tables, so indexes added to the
+    model after a table was created are created here. Before a unique
+    index is created, existing rows are checked for duplicates; they
+    are reported rather than deleted, since each may be a real account.
+    Legacy plaintext reset tokens left in `users.reset_token` are
+    cleared, since only the reset_tokens table is read.
+
+    Args:
+        engine: Engine bound to the database to migrate
+
+    Raises:
+        MigrationError: If existing rows violate a new unique index
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(update(User.__table__).where(
+            User.reset_token.isnot(None)).values(reset_token=None))
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(
+            table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                duplicates = _duplicates(engine, index)
+                if duplicates:
+                    raise MigrationError(
+                        "Cannot create unique index {} on {}({}): "
+                        "duplicated values {}. Merge or delete the "
+                        "duplicated rows, then migrate again.".format(
+                            index.name, table.name,
+                            ", ".join(c.name for c in index.columns),
+                            ", ".join("{!r} ({} rows)".format(
+                                row[:-1] if len(row) > 2 else row[0],
+                                row[-1]) for row in duplicates)))
+            index.create(engine)
+
+
+def _database_url(url: str = None) -> str:
+    """
+    Resolve the database URL
+
+    Args:
+        url: Explicit URL, if any
+
+    Returns:
+        str: `url`, else AUTH_DB_URL, else sqlite:///a.db
+    """
+    return url or os.getenv("AUTH_DB_URL", "sqlite:///a.db")
+
+
+def _engine_options(url: str) -> dict:
+    """
+    Build create_engine pool options from the environment
+
+    AUTH_DB_POOL selects "queue" (QueuePool sized by AUTH_DB_POOL_SIZE,
+    AUTH_DB_MAX_OVERFLOW and AUTH_DB_POOL_TIMEOUT) or "static" (one shared
+    connection, the default for in-memory SQLite).
+
+    Args:
+        url: Database URL the engine is created for
+
+    Returns:
+        dict: Keyword arguments for create_engine
+    """
+    sqlite = url.startswith("sqlite")
+    in_memory = sqlite and (url in ("sqlite://", "sqlite:///")
+                            or ":memory:" in url)
+    options = {}
+    if sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    pool = os.getenv("AUTH_DB_POOL", "static" if in_memory else "queue")
+    if pool == "static":
+        options["poolclass"] = StaticPool
+    else:
+        options.update(
+            poolclass=QueuePool,
+            pool_size=int(os.getenv("AUTH_DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("AUTH_DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("AUTH_DB_POOL_TIMEOUT", "30")),
+        )
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Configure each new SQLite connection for concurrent use
+
+    WAL lets readers proceed while a writer commits, and the busy timeout
+    (AUTH_DB_BUSY_TIMEOUT, in milliseconds) makes writers wait for the
+    lock instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout={:d}".format(
+        int(os.getenv("AUTH_DB_BUSY_TIMEOUT", "5000"))))
+    cursor.close()
 
 
 class DB:
     """DB class for database operations"""
 
-    def __init__(self) -> None:
-        """Initialize a new DB instance"""
-        self._engine = create_engine("sqlite:///a.db", echo=True)
-        Base.metadata.drop_all(self._engine)
-        Base.metadata.create_all(self._engine)
-        self.__session = None
+    def __init__(self, url: str = None, persistent: bool = None,
+                 echo: bool = None) -> None:
+        """
+        Initialize a new DB instance
+
+        By default the schema is dropped and recreated on every start.
+        In persistent mode (AUTH_DB_PERSISTENT=1) existing data is kept,
+        DDL only runs when the schema is out of date, and the connection
+        pool is filled before the first request.
+
+        Args:
+            url: Database URL, defaults to AUTH_DB_URL or sqlite:///a.db
+            persistent: Keep existing data, defaults to AUTH_DB_PERSISTENT
+            echo: Log every SQL statement, defaults to AUTH_DB_ECHO
+        """
+        url = _database_url(url)
+        if persistent is None:
+            persistent = os.getenv("AUTH_DB_PERSISTENT", "0") == "1"
+        if echo is None:
+            echo = os.getenv("AUTH_DB_ECHO", "0") == "1"
+        self._engine = create_engine(url, echo=echo, **_engine_options(url))
+        if url.startswith("sqlite"):
+            event.listen(self._engine, "connect", _sqlite_pragmas)
+        if persistent:
+            if not _schema_is_current(self._engine):
+                migrate(self._engine)
+            self._warm_pool()
+        else:
+            Base.metadata.drop_all(self._engine)
+            migrate(self._engine)
+        self.__session = scoped_session(sessionmaker(bind=self._engine))
+
+    def _warm_pool(self) -> None:
+        """Open the pool's connections up front so requests reuse them"""
+        size = getattr(self._engine.pool, "size", lambda: 1)()
+        connections = [self._engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.close()
 
     @property
     def _session(self) -> Session:
-        """Memoized session object"""
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        """Session of the current thread"""
+        return self.__session()
+
+    def remove_session(self) -> None:
+        """Close the current thread's session and return its connection"""
+        self.__session.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """
@@ -40,12 +237,62 @@ class DB:
 
         Returns:
             User: New User object
+
+        Raises:
+            IntegrityError: If the email is already registered
         """
         new_user = User(email=email, hashed_password=hashed_password)
         self._session.add(new_user)
-        self._session.commit()
+        try:
+            self._session.commit()
+        except IntegrityError:
+            self._session.rollback()
+            raise
         return new_user
 
+    def add_users(self, users: List[Dict[str, str]],
+                  chunk_size: int = 1000) -> int:
+        """
+        Insert many users, one bulk INSERT and transaction per chunk
+
+        Args:
+            users: Dictionaries with `email` and `hashed_password`
+            chunk_size: Rows inserted per transaction
+
+        Returns:
+            int: Number of inserted users
+
+        Raises:
+            IntegrityError: If a chunk violates a constraint; that chunk is
+                rolled back, earlier chunks stay committed
+        """
+        for start in range(0, len(users), chunk_size):
+            try:
+                self._session.bulk_insert_mappings(
+                    User, users[start:start + chunk_size])
+                self._session.commit()
+            except IntegrityError:
+                self._session.rollback()
+                raise
+        return len(users)
+
+    def existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        """
+        Find which of the given emails are already registered
+
+        Args:
+            emails: Emails to check, looked up with a single IN query
+
+        Returns:
+            set: The registered emails
+        """
+        emails = list(emails)
+        if not emails:
+            return set()
+        rows = self._session.query(User.email).filter(
+            User.email.in_(emails))
+        return {email for email, in rows}
+
     def find_user_by(self, **kwargs) -> User:
         """
         Find user by arbitrary attributes
@@ -68,6 +315,24 @@ class DB:
             raise NoResultFound
         return user
 
+    def get_user(self, user_id: int) -> User:
+        """
+        Get a user by primary key, reusing the session's identity map
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            User: Found user object
+
+        Raises:
+            NoResultFound: If no user is found
+        """
+        user = self._session.get(User, user_id)
+        if user is None:
+            raise NoResultFound
+        return user
+
     def update_user(self, user_id: int, **kwargs) -> None:
         """
         Update user attributes
@@ -80,11 +345,165 @@ class DB:
             ValueError: If invalid attributes are passed
             NoResultFound: If user is not found
         """
-        user = self.find_user_by(id=user_id)
+        if not kwargs:
+            self.find_user_by(id=user_id)
+            return
+        if not self.update_user_by({"id": user_id}, **kwargs):
+            raise NoResultFound
+
+    def update_user_by(self, criteria: dict, **kwargs) -> int:
+        """
+        Update the users matching `criteria` with a single UPDATE statement
+
+        Column names are checked against the User mapper, so no row has
+        to be loaded before writing.
 
-        for key, value in kwargs.items():
-            if not hasattr(user, key):
-                raise ValueError
-            setattr(user, key, value)
+        Args:
+            criteria: Column/value pairs the rows must match
+            **kwargs: Column/value pairs to set
+
+        Returns:
+            int: Number of updated rows
 
+        Raises:
+            InvalidRequestError: If criteria are missing or invalid
+            ValueError: If invalid attributes are passed
+        """
+        columns = _user_columns()
+        if not criteria or not columns.issuperset(criteria):
+            raise InvalidRequestError
+        if not columns.issuperset(kwargs):
+            raise ValueError
+        count = self._session.query(User).filter_by(**criteria).update(
+            kwargs, synchronize_session=False)
         self._session.commit()
+        return count
+
+    def add_reset_token(self, user_id: int, token_hash: str,
+                        expires_at: datetime) -> None:
+        """
+        Store a password reset token digest, replacing the user's earlier
+        tokens in the same transaction so that only the latest one works
+
+        Args:
+            user_id: ID of the user the token resets
+            token_hash: Digest of the token
+            expires_at: UTC expiry time
+        """
+        try:
+            self._session.query(ResetToken).filter_by(
+                user_id=user_id).delete(synchronize_session=False)
+            self._session.add(ResetToken(user_id=user_id,
+                                         token_hash=token_hash,
+                                         expires_at=expires_at))
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    def find_reset_token(self, token_hash: str) -> ResetToken:
+        """
+        Find a reset token by digest, through its unique index
+
+        Args:
+            token_hash: Digest of the token
+
+        Returns:
+            ResetToken: Found token
+
+        Raises:
+            NoResultFound: If no token has this digest
+        """
+        token = self._session.query(ResetToken).filter_by(
+            token_hash=token_hash).first()
+        if token is None:
+            raise NoResultFound
+        return token
+
+    def redeem_reset_token(self, token_hash: str, user_id: int,
+                           now: datetime, hashed_password: str) -> None:
+        """
+        Consume a reset token and set the user's new password, in one
+        transaction
+
+        The token is deleted first, with a single DELETE that must match
+        exactly one unexpired row, so of concurrent redemptions of the
+        same token only one succeeds. The read transaction of an earlier
+        lookup is ended first, so the DELETE waits for concurrent writers
+        instead of failing on a stale SQLite snapshot.
+
+        Args:
+            token_hash: Digest of the token
+            user_id: ID of the user the token was issued to
+            now: Current UTC time
+            hashed_password: New hashed password
+
+        Raises:
+            NoResultFound: If the token was already used, has expired, or
+                its user no longer exists; nothing is changed
+        """
+        self._session.rollback()
+        try:
+            consumed = self._session.query(ResetToken).filter(
+                ResetToken.token_hash == token_hash,
+                ResetToken.user_id == user_id,
+                ResetToken.expires_at >= now).delete(
+                synchronize_session=False)
+            if consumed != 1:
+                raise NoResultFound
+            updated = self._session.query(User).filter_by(
+                id=user_id).update({"hashed_password": hashed_password},
+                                   synchronize_session=False)
+            if updated != 1:
+                raise NoResultFound
+            self._session.query(ResetToken).filter_by(
+                user_id=user_id).delete(synchronize_session=False)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    def delete_reset_tokens(self, user_id: int) -> int:
+        """
+        Delete every reset token of a user
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            int: Number of deleted tokens
+        """
+        count = self._session.query(ResetToken).filter_by(
+            user_id=user_id).delete(synchronize_session=False)
+        self._session.commit()
+        return count
+
+    def purge_reset_tokens(self, now: datetime, batch_size: int = 1000) -> int:
+        """
+        Delete up to `batch_size` reset tokens that expired before `now`
+
+        Args:
+            now: Current UTC time
+            batch_size: Maximum number of tokens deleted
+
+        Returns:
+            int: Number of deleted tokens
+        """
+        ids = [token_id for token_id, in self._session.query(
+            ResetToken.id).filter(ResetToken.expires_at < now).limit(
+            batch_size)]
+        if not ids:
+            return 0
+        count = self._session.query(ResetToken).filter(
+            ResetToken.id.in_(ids)).delete(synchronize_session=False)
+        self._session.commit()
+        return count
+
+
+if __name__ == "__main__":
+    import sys
+
+    try:
+        migrate(create_engine(_database_url()))
+    except MigrationError as error:
+        sys.exit(str(error))
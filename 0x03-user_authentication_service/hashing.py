@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Bounded executor for bcrypt-heavy work
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+
+class ExecutorSaturated(Exception):
+    """Raised when hashing work is rejected or does not finish in time"""
+
+
+class HashingExecutor:
+    """
+    Thread pool with a bounded queue for password hashing
+
+    bcrypt releases the GIL, so a small dedicated pool keeps slow hashing
+    off the request threads. At most `workers + queue_limit` calls are
+    admitted at once; further calls are rejected immediately so that
+    cheap routes keep their request threads.
+    """
+
+    def __init__(self, workers: int = 4, queue_limit: int = 32,
+                 timeout: float = 5.0,
+                 teardown: Optional[Callable[[], None]] = None) -> None:
+        """
+        Initialize the executor
+
+        Args:
+            workers: Number of hashing threads
+            queue_limit: Calls allowed to wait for a free thread
+            timeout: Seconds a caller waits for a slot and for a worker to
+                start its call
+            teardown: Called on the worker thread after every task, e.g.
+                to release thread-local database sessions
+        """
+        self._teardown = teardown
+        self._workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, float]] = {}
+
+    def _route(self, route: str) -> Dict[str, float]:
+        """Return the metrics record of a route, creating it if needed"""
+        return self._metrics.setdefault(route, {
+            "calls": 0, "rejected": 0, "timeouts": 0,
+            "queue_wait_total": 0.0, "queue_wait_max": 0.0,
+            "hash_total": 0.0, "hash_max": 0.0,
+        })
+
+    def _record(self, route: str, waited: float, ran: float) -> None:
+        """Account one completed call"""
+        with self._lock:
+            stats = self._route(route)
+            stats["calls"] += 1
+            stats["queue_wait_total"] += waited
+            stats["queue_wait_max"] = max(stats["queue_wait_max"], waited)
+            stats["hash_total"] += ran
+            stats["hash_max"] = max(stats["hash_max"], ran)
+
+    def _count(self, route: str, key: str) -> None:
+        """Increment a failure counter of a route"""
+        with self._lock:
+            self._route(route)[key] += 1
+
+    def _submit(self, route: str, func: Callable, args: tuple,
+                kwargs: dict, block: bool) -> Future:
+        """
+        Admit a call and hand it to the pool
+
+        Args:
+            route: Label under which the call's metrics are recorded
+            func: Callable to run
+            args: Positional arguments for `func`
+            kwargs: Keyword arguments for `func`
+            block: Wait up to the timeout for a slot instead of failing
+                at once
+
+        Returns:
+            Future: Future of the call
+
+        Raises:
+            ExecutorSaturated: If no slot could be acquired
+        """
+        if block:
+            admitted = self._slots.acquire(timeout=self._timeout)
+        else:
+            admitted = self._slots.acquire(blocking=False)
+        if not admitted:
+            self._count(route, "rejected")
+            raise ExecutorSaturated(route)
+        submitted = time.perf_counter()
+
+        def task() -> Any:
+            """Time the call from the worker thread"""
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(route, started - submitted,
+                             time.perf_counter() - started)
+                if self._teardown is not None:
+                    self._teardown()
+
+        try:
+            future = self._pool.submit(task)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _result(self, route: str, future: Future) -> Any:
+        """
+        Wait for a submitted call, counting a timeout
+
+        The timeout only bounds the wait for a worker: a call still queued
+        when it expires is cancelled, while a call already running is
+        waited for, so that its side effects are never reported as failed.
+        """
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            if not future.cancel():
+                return future.result()
+            self._count(route, "timeouts")
+            raise ExecutorSaturated(route)
+
+    def run(self, route: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run `func` on the hashing pool and wait for its result
+
+        Exceptions raised by `func` propagate to the caller. A call that
+        has not started within the timeout is cancelled; once started, it
+        is waited for until it completes.
+
+        Args:
+            route: Label under which the call's metrics are recorded
+            func: Callable to run
+            *args: Positional arguments for `func`
+            **kwargs: Keyword arguments for `func`
+
+        Returns:
+            Any: What `func` returned
+
+        Raises:
+            ExecutorSaturated: If the queue is full or the call does not
+                start in time
+        """
+        return self._result(route,
+                            self._submit(route, func, args, kwargs, False))
+
+    def map(self, route: str, func: Callable,
+            items: Iterable) -> Iterator[Any]:
+        """
+        Run `func` over many items on the pool, yielding results in order
+
+        Meant for batch work: at most `workers` of its calls are admitted
+        at once, so a batch waits for slots (up to the timeout) instead
+        of filling the queue that single requests rely on.
+
+        Args:
+            route: Label under which the calls' metrics are recorded
+            func: Callable taking one item
+            items: Items to process
+
+        Returns:
+            Iterator[Any]: What `func` returned for each item
+
+        Raises:
+            ExecutorSaturated: If a slot is not obtained or a call does not
+                start in time
+        """
+        pending: "deque[Future]" = deque()
+        for item in items:
+            if len(pending) >= self._workers:
+                yield self._result(route, pending.popleft())
+            pending.append(self._submit(route, func, (item,), {}, True))
+        while pending:
+            yield self._result(route, pending.popleft())
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-route hashing metrics
+
+        Returns:
+            dict: For each route, call/rejection/timeout counts and the
+            average and maximum queue wait and hash time in milliseconds
+        """
+        with self._lock:
+            result = {}
+            for route, stats in self._metrics.items():
+                calls = stats["calls"] or 1
+                result[route] = {
+                    "calls": stats["calls"],
+                    "rejected": stats["rejected"],
+                    "timeouts": stats["timeouts"],
+                    "queue_wait_avg_ms":
+                        stats["queue_wait_total"] / calls * 1000,
+                    "queue_wait_max_ms": stats["queue_wait_max"] * 1000,
+                    "hash_avg_ms": stats["hash_total"] / calls * 1000,
+                    "hash_max_ms": stats["hash_max"] * 1000,
+                }
+            return result
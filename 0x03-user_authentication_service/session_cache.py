@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of session lookups
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from user import User
+
+
+class SessionCache:
+    """
+    Bounded LRU cache mapping session IDs to user snapshots
+
+    Entries expire `ttl` seconds after they were stored, which bounds how
+    long another process's writes (a logout, a password reset) can go
+    unnoticed, so keep it short. Writers in this process invalidate
+    entries by session ID, user ID or email.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 5.0) -> None:
+        """
+        Initialize the cache
+
+        Args:
+            maxsize: Maximum number of cached sessions
+            ttl: Seconds an entry stays valid
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._by_email: Dict[str, Set[str]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def generation(self) -> int:
+        """Counter bumped by every invalidation, see put()"""
+        return self._generation
+
+    def _drop(self, session_id: str) -> None:
+        """Remove an entry and its reverse index references"""
+        _, user = self._entries.pop(session_id)
+        for index, key in ((self._by_user, user.id),
+                           (self._by_email, user.email)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(session_id)
+                if not ids:
+                    del index[key]
+
+    def get(self, session_id: str) -> Optional[User]:
+        """
+        Look up a cached session
+
+        Args:
+            session_id: Session ID to look up
+
+        Returns:
+            User: Snapshot of the session's user, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(session_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, session_id: str, user: User,
+            generation: int = None) -> None:
+        """
+        Cache the user owning a session
+
+        Args:
+            session_id: Session ID
+            user: Detached snapshot of the session's user
+            generation: Value of `generation` read before loading `user`;
+                if an invalidation happened since, the user may be stale
+                and is not cached
+        """
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if session_id in self._entries:
+                self._drop(session_id)
+            self._entries[session_id] = (time.monotonic() + self._ttl, user)
+            self._by_user.setdefault(user.id, set()).add(session_id)
+            self._by_email.setdefault(user.email, set()).add(session_id)
+            while len(self._entries) > self._maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, session_id: str) -> None:
+        """Forget one session"""
+        with self._lock:
+            self._generation += 1
+            if session_id in self._entries:
+                self._drop(session_id)
+
+    def invalidate_user(self, user_id: int = None, email: str = None) -> None:
+        """
+        Forget every session of a user
+
+        Args:
+            user_id: ID of the user
+            email: Email of the user, when the ID is not known
+        """
+        with self._lock:
+            self._generation += 1
+            session_ids = set(self._by_user.get(user_id, ()))
+            session_ids.update(self._by_email.get(email, ()))
+            for session_id in session_ids:
+                self._drop(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Cache counters
+
+        Returns:
+            dict: Size, hits, misses and evictions
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
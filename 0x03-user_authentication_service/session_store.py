@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Session storage backends
+"""
+import os
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from db import DB
+from user import User
+
+
+class SessionStore(ABC):
+    """
+    Interface of session storage backends
+
+    A store maps session IDs to user IDs. Backends other than SQL keep
+    any number of sessions per user and expire them after `ttl` seconds.
+    Backends must implement create, get, delete and delete_user.
+    """
+
+    @abstractmethod
+    def create(self, session_id: str, user_id: int) -> None:
+        """
+        Store a new session
+
+        Args:
+            session_id: New session ID
+            user_id: ID of the session's user
+        """
+        raise NotImplementedError
+
+    def create_for_email(self, db: DB, session_id: str, email: str) -> bool:
+        """
+        Store a new session for the user with the given email
+
+        Args:
+            db: Database to resolve the email with
+            session_id: New session ID
+            email: Email of the session's user
+
+        Returns:
+            bool: False if no user has this email
+        """
+        try:
+            user = db.find_user_by(email=email)
+        except NoResultFound:
+            return False
+        self.create(session_id, user.id)
+        return True
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[int]:
+        """
+        Look up a session
+
+        Args:
+            session_id: Session ID to look up
+
+        Returns:
+            int: ID of the session's user, None if unknown or expired
+        """
+        raise NotImplementedError
+
+    def get_user(self, db: DB, session_id: str) -> Optional[User]:
+        """
+        Look up the user owning a session
+
+        Args:
+            db: Database to load the user from
+            session_id: Session ID to look up
+
+        Returns:
+            User: The session's user, None if unknown or expired
+        """
+        user_id = self.get(session_id)
+        if user_id is None:
+            return None
+        try:
+            return db.get_user(user_id)
+        except NoResultFound:
+            return None
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """
+        Delete one session
+
+        Args:
+            session_id: Session ID to delete
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_user(self, user_id: int) -> None:
+        """
+        Delete every session of a user
+
+        Args:
+            user_id: ID of the user
+        """
+        raise NotImplementedError
+
+
+class SQLSessionStore(SessionStore):
+    """Sessions kept in the users.session_id column, one per user"""
+
+    def __init__(self, db: DB) -> None:
+        """
+        Initialize the store
+
+        Args:
+            db: Database holding the users table
+        """
+        self._db = db
+
+    def create(self, session_id: str, user_id: int) -> None:
+        """Replace the user's session"""
+        self._db.update_user(user_id, session_id=session_id)
+
+    def create_for_email(self, db: DB, session_id: str, email: str) -> bool:
+        """Replace the user's session with a single UPDATE by email"""
+        return bool(self._db.update_user_by({"email": email},
+                                            session_id=session_id))
+
+    def get(self, session_id: str) -> Optional[int]:
+        """Look up the user holding the session"""
+        user = self.get_user(self._db, session_id)
+        return None if user is None else user.id
+
+    def get_user(self, db: DB, session_id: str) -> Optional[User]:
+        """Load the user holding the session with a single SELECT"""
+        try:
+            return self._db.find_user_by(session_id=session_id)
+        except NoResultFound:
+            return None
+
+    def delete(self, session_id: str) -> None:
+        """Clear the session from its user"""
+        self._db.update_user_by({"session_id": session_id}, session_id=None)
+
+    def delete_user(self, user_id: int) -> None:
+        """Clear the user's session"""
+        try:
+            self._db.update_user(user_id, session_id=None)
+        except NoResultFound:
+            pass
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions kept in a process-local dictionary with expiry"""
+
+    def __init__(self, ttl: float = 86400.0) -> None:
+        """
+        Initialize the store
+
+        Args:
+            ttl: Seconds a session stays valid
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Tuple[int, float]] = {}
+        self._by_user: Dict[int, Set[str]] = {}
+        self._next_purge = time.monotonic() + ttl
+
+    def _remove(self, session_id: str) -> None:
+        """Drop a session and its user index entry; caller holds the lock"""
+        user_id, _ = self._sessions.pop(session_id)
+        ids = self._by_user.get(user_id)
+        if ids is not None:
+            ids.discard(session_id)
+            if not ids:
+                del self._by_user[user_id]
+
+    def _purge(self, now: float) -> None:
+        """Drop every expired session; caller holds the lock"""
+        expired = [session_id for session_id, (_, expires)
+                   in self._sessions.items() if expires < now]
+        for session_id in expired:
+            self._remove(session_id)
+        self._next_purge = now + self._ttl
+
+    def create(self, session_id: str, user_id: int) -> None:
+        """Add a session for the user"""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_purge:
+                self._purge(now)
+            self._sessions[session_id] = (user_id, now + self._ttl)
+            self._by_user.setdefault(user_id, set()).add(session_id)
+
+    def get(self, session_id: str) -> Optional[int]:
+        """Look up a live session"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                self._remove(session_id)
+                return None
+            return entry[0]
+
+    def delete(self, session_id: str) -> None:
+        """Drop one session"""
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def delete_user(self, user_id: int) -> None:
+        """Drop every session of the user"""
+        with self._lock:
+            for session_id in list(self._by_user.get(user_id, ())):
+                self._remove(session_id)
+
+
+class RESPError(Exception):
+    """Error reply from a RESP server"""
+
+
+class RESPSessionStore(SessionStore):
+    """
+    Sessions kept in a Redis-protocol key-value server
+
+    `session:<id>` holds the user ID with an expiry, and the set
+    `user_sessions:<user_id>` lists the user's sessions. Each thread
+    keeps its own connection; commands of one operation are pipelined.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0",
+                 ttl: int = 86400, timeout: float = 5.0) -> None:
+        """
+        Initialize the store; connections are opened on first use
+
+        Args:
+            url: redis://[:password@]host[:port][/db] URL of the server
+            ttl: Seconds a session stays valid
+            timeout: Socket timeout in seconds
+        """
+        parsed = urlparse(url)
+        self._address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self._password = parsed.password
+        self._database = int(parsed.path.lstrip("/") or 0)
+        self._ttl = int(ttl)
+        self._timeout = timeout
+        self._local = threading.local()
+
+    @staticmethod
+    def _encode(args: Tuple) -> bytes:
+        """Encode a command as a RESP array of bulk strings"""
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self, reader):
+        """
+        Parse one RESP reply
+
+        Error replies are returned as RESPError instances rather than
+        raised, so that the rest of a pipeline is still read.
+        """
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RESPError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            size = int(payload)
+            if size < 0:
+                return None
+            return reader.read(size + 2)[:-2].decode("utf-8")
+        if kind == b"*":
+            size = int(payload)
+            if size < 0:
+                return None
+            return [self._read_reply(reader) for _ in range(size)]
+        raise RESPError("Unexpected reply: {!r}".format(line))
+
+    def _connection(self) -> Tuple[socket.socket, object]:
+        """Return this thread's connection, opening it if needed"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection(self._address, self._timeout)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            setup = []
+            if self._password:
+                setup.append(("AUTH", self._password))
+            if self._database:
+                setup.append(("SELECT", self._database))
+            if setup:
+                try:
+                    self._pipeline(*setup)
+                except Exception:
+                    self.close()
+                    raise
+        return conn
+
+    def _pipeline(self, *commands: Tuple) -> List:
+        """
+        Send commands in one write and read all their replies
+
+        Every reply is read before the first error reply is raised, and
+        the connection is closed on any other failure, so no reply is
+        ever left for the next command to read.
+        """
+        sock, reader = self._connection()
+        try:
+            sock.sendall(b"".join(self._encode(cmd) for cmd in commands))
+            replies = [self._read_reply(reader) for _ in commands]
+        except Exception:
+            self.close()
+            raise
+        for reply in replies:
+            if isinstance(reply, RESPError):
+                raise reply
+        return replies
+
+    def close(self) -> None:
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn[1].close()
+            conn[0].close()
+
+    def create(self, session_id: str, user_id: int) -> None:
+        """Add a session for the user"""
+        user_key = "user_sessions:{}".format(user_id)
+        self._pipeline(
+            ("SET", "session:" + session_id, user_id, "EX", self._ttl),
+            ("SADD", user_key, session_id),
+            ("EXPIRE", user_key, self._ttl),
+        )
+
+    def get(self, session_id: str) -> Optional[int]:
+        """Look up a live session"""
+        user_id = self._pipeline(("GET", "session:" + session_id))[0]
+        return None if user_id is None else int(user_id)
+
+    def delete(self, session_id: str) -> None:
+        """Drop one session"""
+        user_id = self.get(session_id)
+        commands = [("DEL", "session:" + session_id)]
+        if user_id is not None:
+            commands.append(
+                ("SREM", "user_sessions:{}".format(user_id), session_id))
+        self._pipeline(*commands)
+
+    def delete_user(self, user_id: int) -> None:
+        """Drop every session of the user"""
+        user_key = "user_sessions:{}".format(user_id)
+        session_ids = self._pipeline(("SMEMBERS", user_key))[0] or []
+        self._pipeline(
+            ("DEL", user_key,
+             *("session:" + session_id for session_id in session_ids)))
+
+
+def make_session_store(db: DB, spec: str = None) -> SessionStore:
+    """
+    Build the session store selected by AUTH_SESSION_STORE
+
+    Args:
+        db: Database of the service, used by the SQL store
+        spec: "sql" (default), "memory" or a redis:// URL
+
+    Returns:
+        SessionStore: Configured store
+    """
+    spec = spec or os.getenv("AUTH_SESSION_STORE", "sql")
+    ttl = float(os.getenv("AUTH_SESSION_TTL", "86400"))
+    if spec == "sql":
+        return SQLSessionStore(db)
+    if spec == "memory":
+        return MemorySessionStore(ttl)
+    if spec.startswith("redis://"):
+        return RESPSessionStore(spec, int(ttl))
+    raise ValueError("Unknown session store: {}".format(spec))
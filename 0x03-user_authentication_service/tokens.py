@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Stateless signed session tokens
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+
+def _b64encode(data: bytes) -> str:
+    """URL-safe base64 without padding"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    """Inverse of _b64encode"""
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class TokenSigner:
+    """
+    Issue and verify HMAC-signed, expiring session tokens
+
+    A token reads `<kid>.<user_id>.<issued_ms>.<email>.<signature>`, where
+    the email is base64 encoded and the signature is an HMAC-SHA256 of the
+    preceding fields under the key `kid`. New tokens are signed with the
+    active key; tokens signed with any other configured key still verify,
+    so keys can be rotated without logging everyone out.
+    """
+
+    def __init__(self, keys: Dict[str, bytes], active_kid: str,
+                 ttl: float = 900.0) -> None:
+        """
+        Initialize the signer
+
+        Args:
+            keys: Signing secrets by key ID
+            active_kid: Key ID used to sign new tokens
+            ttl: Seconds a token stays valid
+        """
+        if active_kid not in keys:
+            raise ValueError("Unknown active key id: {}".format(active_kid))
+        self._keys = keys
+        self._active_kid = active_kid
+        self.ttl = ttl
+
+    def _sign(self, kid: str, payload: str) -> str:
+        """Signature of a payload under key `kid`"""
+        return _b64encode(hmac.new(self._keys[kid], payload.encode("utf-8"),
+                                   hashlib.sha256).digest())
+
+    def issue(self, user_id: int, email: str) -> str:
+        """
+        Sign a token for a user
+
+        Args:
+            user_id: ID of the user
+            email: Email of the user
+
+        Returns:
+            str: Signed token
+        """
+        payload = "{}.{}.{}.{}".format(
+            self._active_kid, user_id, int(time.time() * 1000),
+            _b64encode(email.encode("utf-8")))
+        return "{}.{}".format(payload, self._sign(self._active_kid, payload))
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        Check a token's signature and expiry
+
+        Args:
+            token: Token to verify
+
+        Returns:
+            dict: Claims (kid, user_id, issued_ms, email, signature), or
+            None if the token is malformed, forged or expired
+        """
+        try:
+            payload, signature = token.rsplit(".", 1)
+            kid, user_id, issued_ms, email = payload.split(".")
+            if kid not in self._keys or not hmac.compare_digest(
+                    signature.encode("utf-8"),
+                    self._sign(kid, payload).encode("utf-8")):
+                return None
+            claims = {
+                "kid": kid,
+                "user_id": int(user_id),
+                "issued_ms": int(issued_ms),
+                "email": _b64decode(email).decode("utf-8"),
+                "signature": signature,
+            }
+        except (TypeError, ValueError):
+            return None
+        if claims["issued_ms"] / 1000 + self.ttl < time.time():
+            return None
+        return claims
+
+
+class RevocationList:
+    """
+    In-memory record of revoked tokens
+
+    Logging out one token remembers its signature until the token would
+    have expired anyway; logging out a user remembers a single timestamp
+    before which all of the user's tokens are rejected. Revocations are
+    not shared between processes: other workers keep accepting a revoked
+    token until it expires, so the token lifetime bounds how long a
+    logout can be ignored.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        """
+        Initialize the list
+
+        Args:
+            ttl: Token lifetime, after which entries can be forgotten
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = {}
+        self._users: Dict[int, int] = {}
+        self._next_purge = time.time() + ttl
+
+    def _purge(self, now: float) -> None:
+        """Forget entries that only concern expired tokens"""
+        self._tokens = {sig: expires for sig, expires
+                        in self._tokens.items() if expires > now}
+        self._users = {uid: before for uid, before in self._users.items()
+                       if before / 1000 + self._ttl > now}
+        self._next_purge = now + self._ttl
+
+    def revoke(self, claims: dict) -> None:
+        """Reject one token from now on"""
+        now = time.time()
+        with self._lock:
+            if now >= self._next_purge:
+                self._purge(now)
+            self._tokens[claims["signature"]] = \
+                claims["issued_ms"] / 1000 + self._ttl
+
+    def revoke_user(self, user_id: int) -> None:
+        """Reject every token issued to the user so far"""
+        now = time.time()
+        with self._lock:
+            if now >= self._next_purge:
+                self._purge(now)
+            self._users[user_id] = int(now * 1000)
+
+    def is_revoked(self, claims: dict) -> bool:
+        """Tell whether a verified token has been revoked"""
+        with self._lock:
+            before = self._users.get(claims["user_id"])
+            if before is not None and claims["issued_ms"] <= before:
+                return True
+            return claims["signature"] in self._tokens
+
+
+def signer_from_env() -> TokenSigner:
+    """
+    Build a signer from AUTH_TOKEN_KEYS, AUTH_TOKEN_KEY_ID, AUTH_TOKEN_TTL
+
+    AUTH_TOKEN_KEYS lists `kid:secret` pairs separated by commas and
+    AUTH_TOKEN_KEY_ID picks the active one (the first by default). Without
+    keys, a random key is generated, valid for this process only.
+
+    Returns:
+        TokenSigner: Configured signer
+    """
+    spec = os.getenv("AUTH_TOKEN_KEYS")
+    if spec:
+        pairs = [item.split(":", 1) for item in spec.split(",")]
+        keys = {kid: secret.encode("utf-8") for kid, secret in pairs}
+        active = os.getenv("AUTH_TOKEN_KEY_ID", pairs[0][0])
+    else:
+        keys, active = {"local": os.urandom(32)}, "local"
+    return TokenSigner(keys, active,
+                       float(os.getenv("AUTH_TOKEN_TTL", "900")))
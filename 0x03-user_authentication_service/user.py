@@ -2,7 +2,8 @@
 """
 User model module for SQLAlchemy database
 """
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer,
+                        String)
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -16,7 +17,11 @@ class User(Base):
         email (str): User's email address
         hashed_password (str): Hashed password
         session_id (str): Session identifier
-        reset_token (str): Password reset token
+        reset_token (str): Legacy password reset token, superseded by the
+            reset_tokens table
+
+    Emails are unique; session ids and reset tokens are unique among the
+    rows that have one, and every lookup column is indexed.
     """
     __tablename__ = 'users'
 
@@ -25,3 +30,39 @@ class User(Base):
     hashed_password = Column(String(250), nullable=False)
     session_id = Column(String(250), nullable=True)
     reset_token = Column(String(250), nullable=True)
+
+    __table_args__ = (
+        Index('ix_users_email', email, unique=True),
+        Index('ix_users_session_id', session_id, unique=True,
+              sqlite_where=session_id.isnot(None),
+              postgresql_where=session_id.isnot(None)),
+        Index('ix_users_reset_token', reset_token, unique=True,
+              sqlite_where=reset_token.isnot(None),
+              postgresql_where=reset_token.isnot(None)),
+    )
+
+
+class ResetToken(Base):
+    """
+    Password reset token for database table 'reset_tokens'
+    Attributes:
+        id (int): Primary key
+        token_hash (str): SHA-256 hex digest of the token
+        user_id (int): ID of the user the token resets
+        expires_at (datetime): UTC time after which the token is invalid
+
+    Only token digests are stored, so a copy of the database does not
+    reveal usable tokens.
+    """
+    __tablename__ = 'reset_tokens'
+
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_reset_tokens_token_hash', token_hash, unique=True),
+        Index('ix_reset_tokens_user_id', user_id),
+        Index('ix_reset_tokens_expires_at', expires_at),
+    )